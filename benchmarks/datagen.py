@@ -0,0 +1,78 @@
+"""Synthetic frames used by the benchmarks.
+
+Every generator is deterministic for a given ``seed`` so that runs of different
+versions measure the same data.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+
+def wide_frame(rows: int, cols: int = 200, seed: int = 0) -> pd.DataFrame:
+    """Many numeric columns: int64 counters and float64 measures in equal parts."""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(cols):
+        if i % 2:
+            data[f"f{i}"] = rng.normal(size=rows)
+        else:
+            data[f"i{i}"] = rng.integers(0, 1000, size=rows, dtype=np.int64)
+    return pd.DataFrame(data)
+
+
+def tall_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Few columns, many rows: the shape of per shop per hour sales facts."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "shop_id": rng.integers(1, 5000, size=rows, dtype=np.int64),
+            "date": pd.Timestamp("2020-01-01")
+            + pd.to_timedelta(rng.integers(0, 1500, size=rows), unit="D"),
+            "hour": rng.integers(0, 24, size=rows, dtype=np.int64),
+            "sales": rng.gamma(2.0, 50.0, size=rows),
+            "transactions": rng.poisson(20, size=rows).astype(np.int64),
+        }
+    )
+
+
+def string_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """String heavy: short codes, free text names and a low cardinality category."""
+    rng = np.random.default_rng(seed)
+    alphabet = np.array(list("abcdefghijklmnopqrstuvwxyz ÆØÅæøåĄČĘėįšųūž"))
+    words = [
+        "".join(rng.choice(alphabet, size=rng.integers(5, 30))) for _ in range(5000)
+    ]
+    return pd.DataFrame(
+        {
+            "id": np.arange(rows, dtype=np.int64),
+            "code": pd.Series(rng.integers(0, 10**8, size=rows)).map("C{:08d}".format),
+            "name": np.array(words, dtype=object)[
+                rng.integers(0, len(words), size=rows)
+            ],
+            "category": np.array(
+                ["food", "drinks", "non-food", "services"], dtype=object
+            )[rng.integers(0, 4, size=rows)],
+        }
+    )
+
+
+def activities_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Input of ``preprocess_activities``: one period per row with a JSON event list."""
+    rng = np.random.default_rng(seed)
+    events = [None] + [
+        json.dumps(sorted(set(rng.integers(1, 30, size=k).tolist())))
+        for k in (1, 1, 2, 3)
+    ]
+    return pd.DataFrame(
+        {
+            "date": pd.date_range("2000-01-01", periods=rows, freq="H"),
+            "occasion_type_id": np.array(events, dtype=object)[
+                rng.integers(0, len(events), size=rows)
+            ],
+        }
+    )
+
+
+FRAMES = {"wide": wide_frame, "tall": tall_frame, "strings": string_frame}
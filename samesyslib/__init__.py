@@ -1,3 +1,14 @@
 """Common libs used by SameSystem Data Science team"""
 
+import importlib
+
 from samesyslib._version import __version__
+
+# submodules are imported on first attribute access, ``import samesyslib`` stays cheap
+_SUBMODULES = ("db", "db_config", "shards", "utils")
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"samesyslib.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
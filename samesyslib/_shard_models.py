@@ -0,0 +1,26 @@
+"""Pydantic settings models of ``samesyslib.shards``.
+
+Kept apart because pydantic is slow to import: ``samesyslib.shards`` imports this
+module on first access to ``Shard`` or ``ShardsSettings``.
+"""
+
+from typing import Optional
+
+from pydantic import BaseSettings, BaseModel
+
+
+class Shard(BaseModel):
+    name: str
+    host: str
+    port: int
+    login: str
+    password: str
+    schema_: str  # reserved by pydantic
+    connect_args: Optional[dict] = {}
+
+    class Config:
+        fields = {"schema_": "schema"}
+
+
+class ShardsSettings(BaseSettings):
+    SHARDS: list[Shard]
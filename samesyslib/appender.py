@@ -0,0 +1,252 @@
+"""Micro-batching appends of many small frames to one table.
+
+``DB.send_append`` checks the table and writes a file per call, which dominates
+when a job appends thousands of ten-row frames. An ``Appender`` reads the table
+columns once, checks every frame against them while buffering it in memory and
+loads the buffered frames with one LOAD DATA when ``max_rows`` rows or
+``max_bytes`` bytes are buffered, ``max_delay`` seconds after the first buffered
+frame, on ``flush``, ``close`` or at interpreter exit.
+
+Frames may hold any subset of the table columns, columns they leave out are
+loaded as NULL. A table that doesn't exist yet is created from the first flushed
+batch, like ``send_append`` does.
+
+Examples:
+
+    .. code-block:: python
+
+        with db.appender("events", max_rows=50000, max_delay=30) as events:
+            for message in consumer:
+                events.append(parse(message))
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import tempfile
+from typing import TYPE_CHECKING
+
+from samesyslib import metrics
+from samesyslib.buffering import BufferedWriter
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from samesyslib.db import DB
+
+log = logging.getLogger(__name__)
+# no log by default unless log system gets configured in the main code
+log.addHandler(logging.NullHandler())
+
+_TYPE_FAMILIES = {
+    "integer": (
+        "tinyint",
+        "smallint",
+        "mediumint",
+        "int",
+        "integer",
+        "bigint",
+        "bit",
+        "year",
+    ),
+    "real": ("decimal", "numeric", "float", "double", "real"),
+    "temporal": ("date", "datetime", "timestamp", "time"),
+    "binary": ("binary", "varbinary", "tinyblob", "blob", "mediumblob", "longblob"),
+}
+_FAMILY_OF_TYPE = {t: family for family, types in _TYPE_FAMILIES.items() for t in types}
+# numpy dtype kinds accepted by a column family, everything converts to a string
+_ACCEPTED_KINDS = {
+    "integer": "iufb",
+    "real": "iufb",
+    "temporal": "MO",
+    "binary": "OS",
+    "string": "biufcmMOSU",
+}
+# what ``infer_dtype`` says about object columns holding numbers
+_NUMERIC_INFERRED = ("integer", "floating", "mixed-integer-float", "decimal", "boolean")
+
+
+def check_compatible(pdf: pd.DataFrame, columns: dict, table: str = "table"):
+    """Raise TypeError when a column of ``pdf`` can't be loaded into ``columns``.
+
+    ``columns`` is the ``{name: (data_type, max_length)}`` mapping of
+    ``DB.table_schema``. Floats are accepted by integer columns when every value is
+    a whole number, strings by ``CHAR`` and ``VARCHAR`` columns when they fit.
+    """
+    from pandas.api.types import infer_dtype
+
+    unknown = [name for name in pdf.columns if name not in columns]
+    if unknown:
+        raise ValueError(f"Columns {unknown} not in {table}")
+
+    for name, col in pdf.items():
+        data_type, length = columns[name]
+        family = _FAMILY_OF_TYPE.get(data_type, "string")
+        values = col.dropna()
+        if values.empty:
+            continue
+        kind = col.dtype.kind
+        compatible = kind in _ACCEPTED_KINDS[family]
+        if family in ("integer", "real") and kind == "O":
+            compatible = infer_dtype(values, skipna=True) in _NUMERIC_INFERRED
+        if compatible and family == "integer" and kind in "fO":
+            compatible = bool((values.astype(float) % 1 == 0).all())
+        if compatible and family == "string" and data_type in ("char", "varchar"):
+            longest = values.astype(str).str.len().max()
+            if length is not None and longest > length:
+                raise TypeError(
+                    f"Column {name} holds strings up to {longest} characters, "
+                    f"{table}.{name} is {data_type}({length})"
+                )
+        if not compatible:
+            raise TypeError(
+                f"Column {name} of dtype {col.dtype} can't be loaded into "
+                f"{table}.{name} of type {data_type}"
+            )
+
+
+class Appender(BufferedWriter):
+    """Buffers frames appended to one table and loads them in batches.
+
+    Thread-safe. Use ``DB.appender`` to create one.
+
+    Args:
+        conn (DB): database connection
+        table (str): target table
+        schema (str): schema of the table, the connection schema by default
+        max_rows (int): buffered rows triggering a flush
+        max_bytes (int): buffered bytes, as counted by ``memory_usage(deep=True)``,
+            triggering a flush
+        max_delay (float): seconds after which buffered frames are flushed, None
+            to flush on size, explicit ``flush`` and exit only
+        verbose (bool): log the executed statements
+    """
+
+    def __init__(
+        self,
+        conn: DB,
+        table: str,
+        schema: str = None,
+        max_rows: int = 100000,
+        max_bytes: int = 64 * 1024**2,
+        max_delay: float = 10.0,
+        verbose: bool = False,
+    ):
+        super().__init__(flush_delay=max_delay)
+        self.conn = conn
+        self.table = table
+        self.schema = schema or conn._schema
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        self.columns = conn.table_schema(table, self.schema)
+        self._frames = []
+        self._rows = 0
+        self._bytes = 0
+
+    @property
+    def max_delay(self) -> float:
+        return self.flush_delay
+
+    @property
+    def pending_rows(self) -> int:
+        return self._rows
+
+    def append(self, pdf: pd.DataFrame):
+        """Check ``pdf`` against the table and buffer a copy of it."""
+        if pdf.empty:
+            return
+        target = f"{self.schema}.{self.table}"
+        if self.columns is not None:
+            check_compatible(pdf, self.columns, target)
+            pdf = pdf[[name for name in self.columns if name in pdf.columns]]
+        else:
+            pdf = pdf.copy()
+        bools = {name: "uint8" for name, dtype in pdf.dtypes.items() if dtype == bool}
+        if bools:
+            pdf = pdf.astype(bools)
+
+        with self._lock:
+            self._frames.append(pdf)
+            self._rows += pdf.shape[0]
+            self._bytes += int(pdf.memory_usage(index=False, deep=True).sum())
+            full = self._buffered()
+        if full:
+            self.flush()
+
+    def _full(self) -> bool:
+        return self._rows >= self.max_rows or self._bytes >= self.max_bytes
+
+    def _take(self):
+        if not self._frames:
+            return None
+        pending = self._frames, self._rows, self._bytes
+        self._frames, self._rows, self._bytes = [], 0, 0
+        return pending
+
+    def _write(self, pending: tuple):
+        """Load the buffered frames with one LOAD DATA."""
+        import pandas as pd
+
+        frames, _, _ = pending
+        self._load(pd.concat(frames, ignore_index=True, copy=False))
+
+    def _restore(self, pending: tuple):
+        frames, rows, size = pending
+        self._frames = frames + self._frames
+        self._rows += rows
+        self._bytes += size
+
+    def _load(self, batch: pd.DataFrame):
+        import pandas as pd
+
+        target = f"{self.schema}.{self.table}"
+        op_context = metrics.operation(
+            "appender.flush", shard=self.conn._shard, table=self.table
+        )
+        with op_context as op, self.conn.engine.connect() as conn:
+            op.rows = batch.shape[0]
+            checked = self.columns is not None
+            if not checked:
+                self.columns = self.conn.table_schema(self.table, self.schema)
+            if self.columns is None:
+                with op.phase("create"):
+                    conn.execute(f"USE {self.schema}")
+                    create_stmt = pd.io.sql.get_schema(
+                        batch, self.table, con=self.conn.engine
+                    )
+                    if self.verbose:
+                        log.info(f"Executing query:\n{create_stmt}")
+                    conn.execute(create_stmt)
+                self.columns = self.conn.table_schema(
+                    self.table, self.schema, refresh=True
+                )
+            elif not checked:
+                check_compatible(batch, self.columns, target)
+            batch = batch[[name for name in self.columns if name in batch.columns]]
+
+            with tempfile.NamedTemporaryFile() as tf:
+                with op.phase("serialize"):
+                    batch.to_csv(
+                        tf.name,
+                        encoding="utf-8",
+                        header=True,
+                        doublequote=True,
+                        sep=",",
+                        index=False,
+                        na_rep="NULL",
+                    )
+                op.bytes = os.path.getsize(tf.name)
+
+                names = ", ".join(f"`{name}`" for name in batch.columns)
+                load_stmt = f"""
+                LOAD DATA LOCAL INFILE '{tf.name}'
+                INTO TABLE {target} FIELDS TERMINATED BY ',' ENCLOSED BY '\"'
+                IGNORE 1 LINES ({names});
+                """
+                if self.verbose:
+                    log.info(f"Executing query:\n{load_stmt}")
+                with op.phase("load"):
+                    conn.execute(load_stmt)
+        log.info(f"Appended {batch.shape[0]} rows to {target}")
@@ -0,0 +1,116 @@
+"""Base of the writers buffering many small writes in memory.
+
+``MetadataWriter`` and ``Appender`` keep what they are asked to write and write it
+in one batch when their buffer is full, ``flush_delay`` seconds after the first
+buffered write, on ``flush``, ``close`` or at interpreter exit. ``BufferedWriter``
+holds the locking, timer and exit handling they share.
+
+A subclass adds to its buffer under ``self._lock`` and asks ``self._buffered()``
+whether to flush right away, then implements:
+
+    _full()          True when the buffer must be written now
+    _take()          the buffered writes, emptying the buffer; None when empty
+    _write(pending)  write what ``_take`` returned
+    _restore(pending)  put back writes that failed, ahead of newer ones
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
+import weakref
+
+log = logging.getLogger(__name__)
+# no log by default unless log system gets configured in the main code
+log.addHandler(logging.NullHandler())
+
+
+def _exit_flush(ref: weakref.ref):
+    """atexit callback flushing the writer behind ``ref`` if it is still alive"""
+
+    def flush():
+        writer = ref()
+        if writer is not None:
+            writer.flush()
+
+    return flush
+
+
+class BufferedWriter:
+    """Thread-safe buffering with size, time and exit triggered flushes.
+
+    Args:
+        flush_delay (float): seconds after which buffered writes are flushed,
+            None to flush on size, explicit ``flush`` and exit only
+    """
+
+    def __init__(self, flush_delay: float = None):
+        self.flush_delay = flush_delay
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        # a weak reference, writers dropped without close are not kept alive
+        self._exit_flush = _exit_flush(weakref.ref(self))
+        atexit.register(self._exit_flush)
+
+    def _full(self) -> bool:
+        raise NotImplementedError
+
+    def _take(self):
+        raise NotImplementedError
+
+    def _write(self, pending):
+        raise NotImplementedError
+
+    def _restore(self, pending):
+        raise NotImplementedError
+
+    def _buffered(self) -> bool:
+        """Called under ``self._lock`` after buffering, True when the caller must
+        flush once it released the lock.
+        """
+        if self._full():
+            self._cancel_timer()
+            return True
+        if self._timer is None and self.flush_delay is not None:
+            self._timer = threading.Timer(self.flush_delay, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+        return False
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _timed_flush(self):
+        try:
+            self.flush()
+        except Exception as e:
+            log.error(f"SQL EXCEPTION: {str(e)}")
+
+    def flush(self):
+        """Write everything buffered, failed writes stay buffered."""
+        with self._flush_lock:
+            with self._lock:
+                pending = self._take()
+                self._cancel_timer()
+            if pending is None:
+                return
+            try:
+                self._write(pending)
+            except Exception:
+                with self._lock:
+                    self._restore(pending)
+                raise
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self._exit_flush)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
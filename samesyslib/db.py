@@ -1,17 +1,200 @@
+from __future__ import annotations
+
+import contextvars
+import hashlib
 import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager, nullcontext
 from functools import wraps
-from time import time
+from pathlib import Path
+from time import sleep, time
+from typing import TYPE_CHECKING, Iterable, Iterator, Union
 import tempfile
 
-from sqlalchemy import create_engine
-import pandas as pd
-
+from samesyslib import metrics, profiling
 from samesyslib.db_config import DBParams
+from samesyslib.utils import iter_sql_statements
 
 log = logging.getLogger(__name__)
 # no log by default unless log system gets configured in the main code
 log.addHandler(logging.NullHandler())
 
+# pandas and SQLAlchemy are imported by the methods using them, importing this
+# module stays cheap for short lived jobs that never touch a database
+if TYPE_CHECKING:
+    import pandas as pd
+    from concurrent.futures import Future
+
+    from sqlalchemy.engine import Connection, Engine
+
+    from samesyslib.appender import Appender
+    from samesyslib.replicas import ReplicaPool
+    from samesyslib.spill import SpilledFrame
+
+# CLIENT_MULTI_STATEMENTS capability flag of the MySQL client protocol
+CLIENT_MULTI_STATEMENTS = 1 << 16
+# chunks of resumable loads already in the staging table, per load
+LOAD_CHECKPOINT_TABLE = "_samesyslib_load_chunks"
+# set by DB.primary_reads, reads inside the block skip the replicas
+_primary_reads = contextvars.ContextVar("samesyslib_primary_reads", default=False)
+
+# integer types from the narrowest, with their signed and unsigned ranges
+INTEGER_TYPES = (
+    ("TINYINT", -(2**7), 2**7 - 1, 2**8 - 1),
+    ("SMALLINT", -(2**15), 2**15 - 1, 2**16 - 1),
+    ("MEDIUMINT", -(2**23), 2**23 - 1, 2**24 - 1),
+    ("INT", -(2**31), 2**31 - 1, 2**32 - 1),
+    ("BIGINT", -(2**63), 2**63 - 1, 2**64 - 1),
+)
+# a utf8mb4 row holds at most 65535 bytes of VARCHAR, 4 bytes per character
+MAX_ROW_VARCHAR_BYTES = 65535
+
+
+def _integer_type(low: int, high: int) -> str:
+    for name, signed_low, signed_high, unsigned_high in INTEGER_TYPES:
+        if low >= 0 and high <= unsigned_high:
+            return f"{name} UNSIGNED"
+        if low >= signed_low and high <= signed_high:
+            return name
+    return "DECIMAL(20, 0)"
+
+
+def _column_type(col: pd.Series, enum_max_values: int, is_key: bool) -> str:
+    """Narrowest MySQL type holding every value of ``col``"""
+    import numpy as np
+    from pandas.api.types import infer_dtype
+
+    values = col.dropna()
+    dtype = col.dtype
+    if dtype == "category":
+        categories = dtype.categories
+        if not is_key and infer_dtype(categories) == "string":
+            escaped = (str(c).replace("'", "''") for c in categories)
+            return "ENUM({})".format(", ".join(f"'{c}'" for c in escaped))
+        values = values.astype(categories.dtype)
+        dtype = categories.dtype
+    kind = dtype.kind
+
+    if kind == "b":
+        return "TINYINT(1)"
+    if kind in "iu":
+        if values.empty:
+            return "TINYINT"
+        return _integer_type(int(values.min()), int(values.max()))
+    if kind == "f":
+        if 0 < len(values) < len(col) and (values % 1 == 0).all():
+            # integers with NULLs, pandas holds them as floats
+            return _integer_type(int(values.min()), int(values.max()))
+        as_float = values.to_numpy(dtype=np.float64)
+        if dtype.itemsize == 4 or np.array_equal(
+            as_float.astype(np.float32).astype(np.float64), as_float
+        ):
+            return "FLOAT"
+        return "DOUBLE"
+    if kind == "M":
+        if values.empty or (values.dt.normalize() == values).all():
+            return "DATE"
+        if (values.dt.microsecond != 0).any():
+            return "DATETIME(6)"
+        return "DATETIME"
+
+    inferred = infer_dtype(values, skipna=True)
+    if inferred == "date":
+        return "DATE"
+    if inferred in ("datetime", "datetime64"):
+        return "DATETIME"
+    if inferred == "integer":
+        return _integer_type(int(values.min()), int(values.max()))
+    if inferred in ("floating", "mixed-integer-float", "decimal"):
+        return "DOUBLE"
+    if inferred == "boolean":
+        return "TINYINT(1)"
+    if inferred == "bytes":
+        return "LONGBLOB"
+    if values.empty:
+        return "VARCHAR(255)" if is_key else "TEXT"
+
+    strings = values.astype(str)
+    longest = max(1, int(strings.str.len().max()))
+    if not is_key and enum_max_values and longest <= 255:
+        distinct = strings.unique()
+        if len(distinct) <= enum_max_values and len(distinct) < len(strings):
+            escaped = (v.replace("'", "''") for v in sorted(distinct))
+            return "ENUM({})".format(", ".join(f"'{v}'" for v in escaped))
+    return f"VARCHAR({longest})"
+
+
+def create_table_statement(
+    pdf: pd.DataFrame,
+    table: str,
+    primary_key: Union[str, list] = None,
+    enum_max_values: int = 0,
+    max_varchar: int = 4096,
+) -> str:
+    """CREATE TABLE with the narrowest types holding the values of ``pdf``
+
+    Integers get the smallest TINYINT to BIGINT, UNSIGNED when no value is
+    negative, also when NULLs turned them into floats. Floats get FLOAT when
+    float32 holds them exactly, datetimes at midnight get DATE and strings get
+    VARCHAR of their longest value, or TEXT past ``max_varchar`` characters or when
+    the row would exceed the VARCHAR limit. String columns repeating at most
+    ``enum_max_values`` distinct values become ENUM, 0 disables it. Columns of
+    ``primary_key`` are NOT NULL and never TEXT or ENUM.
+
+    Examples:
+
+        .. code-block:: python
+
+            create_table_statement(sales, "sales", primary_key=["shop_id", "day"])
+    """
+    if isinstance(primary_key, str):
+        primary_key = [primary_key]
+    primary_key = list(primary_key or [])
+
+    types = {
+        name: _column_type(col, enum_max_values, name in primary_key)
+        for name, col in pdf.items()
+    }
+    varchars = {
+        name: int(t[len("VARCHAR(") : -1])
+        for name, t in types.items()
+        if t.startswith("VARCHAR(")
+    }
+    row_bytes = sum(4 * n + 2 for n in varchars.values())
+    for name, length in sorted(varchars.items(), key=lambda item: -item[1]):
+        if name in primary_key:
+            continue
+        if length <= max_varchar and row_bytes <= MAX_ROW_VARCHAR_BYTES:
+            break
+        types[name] = "TEXT" if length < 2**14 else "MEDIUMTEXT"
+        row_bytes -= 4 * length + 2
+
+    lines = [
+        f"`{name}` {t}" + (" NOT NULL" if name in primary_key else "")
+        for name, t in types.items()
+    ]
+    if primary_key:
+        keys = ", ".join(f"`{c}`" for c in primary_key)
+        lines.append(f"PRIMARY KEY ({keys})")
+    return "CREATE TABLE `{}` (\n  {}\n)".format(table, ",\n  ".join(lines))
+
+
+def add_indexes_statement(table: str, indexes: Iterable[Union[str, list]]) -> str:
+    """One ALTER TABLE adding every index, the table is rebuilt once.
+
+    ``indexes`` holds column names or lists of column names, one per index.
+    """
+    clauses = []
+    for index in indexes:
+        columns = [index] if isinstance(index, str) else list(index)
+        name = "ix_" + "_".join(columns)
+        clauses.append(
+            f"ADD INDEX `{name[:64]}` ({', '.join(f'`{c}`' for c in columns)})"
+        )
+    return f"ALTER TABLE {table} {', '.join(clauses)};"
+
 
 def timing(f):
     """
@@ -28,7 +211,7 @@ def timing(f):
             if "timing_verbose" in kwargs.keys():
                 verbose = kwargs["timing_verbose"]
         start = time()
-        result = f(*args, **kwargs)
+        result = profiling.call(f, args, kwargs)
         end = time()
         if verbose:
             log.info(
@@ -42,6 +225,8 @@ def timing(f):
 
 class POptimiseDataTypesMixin:
     def mem_usage(self, pandas_obj: pd.DataFrame, **kwargs: dict) -> str:
+        import pandas as pd
+
         if isinstance(pandas_obj, pd.DataFrame):
             usage_b = pandas_obj.memory_usage(deep=True).sum()
         else:  # we assume if not a df it's a series
@@ -53,6 +238,8 @@ class POptimiseDataTypesMixin:
     def optimize_pandas_datatypes(
         self, data: pd.DataFrame, **kwargs: dict
     ) -> pd.DataFrame:
+        import pandas as pd
+
         verbose = False
         if kwargs is not None:
             if "optimize_verbose" in kwargs.keys():
@@ -82,24 +269,84 @@ class POptimiseDataTypesMixin:
 class DB(POptimiseDataTypesMixin):
     _schema = None
     _shard = None
+    _schema_cache = None
+    _replicas = None
+    _executor = None
+    _max_allowed_packet = None
+    _executor_lock = threading.Lock()
+    # threads of the executor shared by submit_get calls
+    SUBMIT_WORKERS = 4
 
     def __init__(self, config: DBParams):
-        self._schema = config.schema
-        self._shard = config._shard
-
-        self.engine = create_engine(
-            f"mysql+{config.connector}://{config.login}:"
-            f"{config.password}@"
-            f"{config.host}"
-            f":{config.port}/"
+        self._setup(
+            self._create_engine(config),
+            schema=config.schema,
+            shard=config._shard,
+            connect_args=config.connect_args,
+        )
+        if config.replicas:
+            from samesyslib.replicas import ReplicaPool
+
+            replicas = []
+            for endpoint in config.replicas:
+                endpoint = {"host": config.host, "port": config.port, **endpoint}
+                name = endpoint.pop("name", f"{endpoint['host']}:{endpoint['port']}")
+                replicas.append((name, self._create_engine(config, **endpoint)))
+            self._replicas = ReplicaPool(
+                replicas,
+                max_lag=config.replica_max_lag,
+                check_interval=config.replica_check_interval,
+            )
+
+        self._check_local_infile()
+
+    @classmethod
+    def from_engine(cls, engine: Engine, schema: str = None, shard: str = None) -> DB:
+        """DB around an existing SQLAlchemy engine, without the checks of a MySQL
+        connection, for tests and tools running on other databases.
+
+        Examples:
+
+            .. code-block:: python
+
+                db = DB.from_engine(create_engine("sqlite://"), schema="main")
+        """
+        db = cls.__new__(cls)
+        db._setup(engine, schema=schema, shard=shard)
+        return db
+
+    def _setup(
+        self,
+        engine: Engine,
+        schema: str = None,
+        shard: str = None,
+        connect_args: dict = None,
+    ):
+        self.engine = engine
+        self._schema = schema
+        self._shard = shard
+        self._connect_args = dict(connect_args or {})
+
+    @staticmethod
+    def _create_engine(config: DBParams, **endpoint: dict):
+        """Engine of the primary, or of a replica overriding some of ``config``"""
+        from sqlalchemy import create_engine
+
+        host = endpoint.get("host", config.host)
+        port = endpoint.get("port", config.port)
+        login = endpoint.get("login", config.login)
+        password = endpoint.get("password", config.password)
+        return create_engine(
+            f"mysql+{config.connector}://{login}:"
+            f"{password}@"
+            f"{host}"
+            f":{port}/"
             f"{config.schema}?charset=utf8mb4&local_infile=1",
             pool_pre_ping=True,
             **config.parameters,
             connect_args={**config.connect_args},
         )
 
-        self._check_local_infile()
-
     def _check_local_infile(self):
         SQL = "SHOW GLOBAL VARIABLES LIKE 'local_infile';"
         result = self.engine.execute(SQL).fetchone()
@@ -108,19 +355,309 @@ class DB(POptimiseDataTypesMixin):
 
     @timing
     def get(self, query: str = None, **kwargs: dict) -> pd.DataFrame:
+        import pandas as pd
+
         verbose = False
         if kwargs is not None:
             if "verbose" in kwargs.keys():
                 verbose = kwargs["verbose"]
         if verbose:
             log.info(f"Executing query:\n{query}")
-        df = self.optimize_pandas_datatypes(
-            pd.read_sql_query(query, self.engine), **kwargs
-        )
+        with metrics.operation("get", shard=self._shard) as op:
+            if kwargs.get("spill_threshold_mb") is not None:
+                return self._get_spilling(query, op, **kwargs)
+            connection = kwargs.get("connection")
+            use_primary = kwargs.get("use_primary", False)
+            with self._connect(connection, use_primary) as conn:
+                with op.phase("execute"):
+                    result = conn.execute(query)
+                with op.phase("fetch"):
+                    columns = list(result.keys())
+                    data = result.fetchall()
+            with op.phase("frame_build"):
+                df = pd.DataFrame.from_records(data, columns=columns, coerce_float=True)
+                del data
+            with op.phase("dtype_optimize"):
+                df = self.optimize_pandas_datatypes(df, **kwargs)
+            op.rows = df.shape[0]
+            op.bytes = int(df.memory_usage(index=False).sum())
         if verbose:
             log.info(f"Returned table shape: {df.shape}")
         return df
 
+    def _connect(self, connection: Connection = None, use_primary: bool = False):
+        """Connection for a read, ``connection`` when given, reads of session
+        temporary tables need it.
+        """
+        if connection is not None:
+            return nullcontext(connection)
+        return self._read_connection(use_primary)
+
+    def _read_connection(self, use_primary: bool = False) -> Connection:
+        """New connection to a healthy replica, or to the primary when there is
+        none, ``use_primary`` is set or inside ``primary_reads``.
+        """
+        if self._replicas is None or use_primary or _primary_reads.get():
+            return self.engine.connect()
+        replica = self._replicas.choose()
+        if replica is None:
+            return self.engine.connect()
+        try:
+            return replica.engine.connect()
+        except Exception as e:
+            self._replicas.mark_failed(replica, e)
+            return self.engine.connect()
+
+    @contextmanager
+    def primary_reads(self):
+        """Read from the primary inside the block, for reads of just written rows
+
+        Examples:
+
+            .. code-block:: python
+
+                db.send(df, "daily_sales")
+                with db.primary_reads():
+                    check = db.get("SELECT COUNT(*) AS n FROM daily_sales")
+        """
+        token = _primary_reads.set(True)
+        try:
+            yield
+        finally:
+            _primary_reads.reset(token)
+
+    @property
+    def replicas(self) -> Union[ReplicaPool, None]:
+        return self._replicas
+
+    @contextmanager
+    def temporary_ids(
+        self, ids: Iterable, column: str = "id", use_primary: bool = False
+    ) -> Iterator[tuple[Connection, str]]:
+        """Load ``ids`` into a session temporary table keyed on ``column``
+
+        Yields the connection holding the table and the table name, the table is
+        only visible to queries run on that connection and dropped on exit. The ids
+        are sent with one executemany, the driver packs them into multi-row
+        INSERTs.
+
+        Examples:
+
+            .. code-block:: python
+
+                with db.temporary_ids(shop_ids) as (conn, ids):
+                    df = db.get(
+                        f"SELECT s.* FROM sales AS s JOIN {ids} USING (id)",
+                        connection=conn,
+                    )
+        """
+        import pandas as pd
+        from sqlalchemy import text
+
+        values = pd.Series(pd.unique(pd.Series(list(ids)).dropna()))
+        if values.dtype.kind in "iub":
+            column_type = "BIGINT"
+        else:
+            values = values.astype(str)
+            longest = int(values.str.len().max()) if len(values) else 1
+            column_type = f"VARCHAR({max(1, longest)})"
+        table = f"_ids_{uuid.uuid4().hex[:12]}"
+
+        with metrics.operation("temporary_ids", shard=self._shard) as op:
+            op.rows = len(values)
+            # temporary tables are allowed on read_only replicas
+            conn = self._read_connection(use_primary)
+            try:
+                conn.execute(
+                    f"CREATE TEMPORARY TABLE {table} "
+                    f"(`{column}` {column_type} NOT NULL, PRIMARY KEY (`{column}`))"
+                )
+                if len(values):
+                    conn.execute(
+                        text(f"INSERT INTO {table} (`{column}`) VALUES (:v)"),
+                        [{"v": v} for v in values.tolist()],
+                    )
+            except BaseException:
+                conn.close()
+                raise
+        try:
+            yield conn, table
+        finally:
+            # the name is unique to this call, no permanent table can be hit
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.close()
+
+    @timing
+    def get_by_ids(
+        self,
+        table: str,
+        ids: Iterable,
+        id_col: str = "shop_id",
+        where: str = None,
+        columns: str = "t.*",
+        **kwargs: dict,
+    ) -> pd.DataFrame:
+        """Rows of ``table`` with ``id_col`` in ``ids``, read with one JOIN
+
+        Replaces ``WHERE id_col IN (...)`` literals of thousands of ids: the ids go
+        to a temporary table with ``temporary_ids`` and the read joins it on the
+        index of ``id_col``. ``where`` adds conditions on ``table``, aliased ``t``.
+
+        Examples:
+
+            .. code-block:: python
+
+                db.get_by_ids("ml.features", shop_ids, where="t.run_id = 'abc'")
+        """
+        use_primary = kwargs.get("use_primary", False)
+        with self.temporary_ids(ids, use_primary=use_primary) as (conn, ids_table):
+            query = (
+                f"SELECT {columns} FROM {table} AS t "
+                f"JOIN {ids_table} AS ids ON t.`{id_col}` = ids.`id`"
+            )
+            if where:
+                query += f" WHERE {where}"
+            return self.get(query, connection=conn, **kwargs)
+
+    def submit_get(self, query: str, **kwargs: dict) -> Future:
+        """Run ``get(query, **kwargs)`` in a background thread, returns its future
+
+        Threads come from an executor shared by all ``submit_get`` calls of this
+        connection, ``SUBMIT_WORKERS`` of them; connections come from the engine
+        pool. ``primary_reads`` and ``profiling`` blocks around the call apply to it.
+
+        Examples:
+
+            .. code-block:: python
+
+                sales = db.submit_get("SELECT * FROM sales")
+                shops = db.get("SELECT * FROM shops")
+                sales = sales.result()
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.SUBMIT_WORKERS,
+                    thread_name_prefix="samesyslib-get",
+                )
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self.get, query, **kwargs)
+
+    def get_many(
+        self,
+        queries: Union[dict, list],
+        max_concurrency: int = 4,
+        **kwargs: dict,
+    ) -> dict:
+        """Run independent queries at the same time, ``max_concurrency`` at most
+
+        ``queries`` maps names to queries, a list is keyed by position. Returns the
+        frames keyed the same way, each built and dtype optimized in its worker
+        thread. The first failing query cancels the ones not started yet and its
+        exception is raised.
+
+        Examples:
+
+            .. code-block:: python
+
+                frames = db.get_many(
+                    {"sales": "SELECT * FROM sales", "shops": "SELECT * FROM shops"},
+                    max_concurrency=8,
+                )
+        """
+        from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+        if not isinstance(queries, dict):
+            queries = dict(enumerate(queries))
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_concurrency, len(queries))),
+            thread_name_prefix="samesyslib-get",
+        ) as executor:
+            futures = {
+                name: executor.submit(
+                    contextvars.copy_context().run, self.get, query, **kwargs
+                )
+                for name, query in queries.items()
+            }
+            _, pending = wait(futures.values(), return_when=FIRST_EXCEPTION)
+            for future in pending:
+                future.cancel()
+        for future in futures.values():
+            if not future.cancelled() and future.exception() is not None:
+                raise future.exception()
+        return {name: future.result() for name, future in futures.items()}
+
+    def _get_spilling(
+        self,
+        query: str,
+        op: metrics.Operation,
+        spill_threshold_mb: float,
+        spill_dir: Union[str, Path] = None,
+        spill_chunksize: int = 100000,
+        **kwargs: dict,
+    ) -> Union[pd.DataFrame, SpilledFrame]:
+        """Stream a query result, spilling it to column files once the chunks
+        buffered in memory exceed ``spill_threshold_mb``.
+        """
+        import pandas as pd
+
+        from samesyslib.spill import SpillWriter
+
+        buffered = []
+        buffered_bytes = 0
+        writer = None
+        connection = kwargs.get("connection")
+        with self._connect(connection, kwargs.get("use_primary", False)) as conn:
+            with op.phase("execute"):
+                result = conn.execution_options(stream_results=True).execute(query)
+            columns = list(result.keys())
+            try:
+                while True:
+                    with op.phase("fetch"):
+                        data = result.fetchmany(spill_chunksize)
+                    if not data:
+                        break
+                    with op.phase("frame_build"):
+                        chunk = pd.DataFrame.from_records(
+                            data, columns=columns, coerce_float=True
+                        )
+                        del data
+                    if writer is not None:
+                        with op.phase("spill"):
+                            op.bytes += writer.append(chunk)
+                        continue
+                    buffered.append(chunk)
+                    buffered_bytes += chunk.memory_usage(deep=True).sum()
+                    if buffered_bytes > spill_threshold_mb * 1024**2:
+                        writer = SpillWriter(spill_dir)
+                        op.bytes = 0
+                        with op.phase("spill"):
+                            while buffered:
+                                op.bytes += writer.append(buffered.pop(0))
+            except BaseException:
+                if writer is not None:
+                    writer.abort()
+                raise
+
+        if writer is not None:
+            spilled = writer.finish()
+            op.rows = len(spilled)
+            log.info(f"Spilled {op.rows} rows, {op.bytes} bytes to {spilled.directory}")
+            return spilled
+
+        with op.phase("frame_build"):
+            if buffered:
+                df = pd.concat(buffered, ignore_index=True)
+            else:
+                df = pd.DataFrame(columns=columns)
+        with op.phase("dtype_optimize"):
+            df = self.optimize_pandas_datatypes(df, **kwargs)
+        op.rows = df.shape[0]
+        op.bytes = int(df.memory_usage(index=False).sum())
+        return df
+
     @timing
     def send_single(
         self,
@@ -133,18 +670,105 @@ class DB(POptimiseDataTypesMixin):
         method: str = "multi",
         **kwargs: dict,
     ) -> pd.DataFrame:
-        try:
-            pdf.to_sql(
+        """Write ``pdf`` to ``table`` through ``to_sql``, ``InsertWriter`` batches
+        for the default ``method="multi"``.
+
+        Failures are logged and raised, whatever the ``method``.
+        """
+        if method == "multi":
+            return self._insert_native(
+                "send_single",
+                pdf,
                 table,
-                self.engine,
-                chunksize=chunksize,
-                if_exists=if_exists,
-                schema=schema,
-                index=index,
-                method=method,
+                schema,
+                if_exists,
+                index,
+                max_rows=chunksize,
+                **kwargs,
             )
-        except Exception as e:
-            log.error("SQL EXCEPTION: {}".format(str(e)))
+        with metrics.operation("send_single", shard=self._shard, table=table) as op:
+            op.rows = pdf.shape[0]
+            try:
+                with op.phase("insert"):
+                    pdf.to_sql(
+                        table,
+                        self.engine,
+                        chunksize=chunksize,
+                        if_exists=if_exists,
+                        schema=schema,
+                        index=index,
+                        method=method,
+                    )
+            except Exception as e:
+                op.error = str(e)
+                log.error("SQL EXCEPTION: {}".format(str(e)))
+                raise
+        return table
+
+    def max_allowed_packet(self) -> int:
+        """``@@max_allowed_packet`` of the server, read once"""
+        if self._max_allowed_packet is None:
+            try:
+                result = self.engine.execute("SELECT @@max_allowed_packet")
+                self._max_allowed_packet = int(result.scalar())
+            except Exception as e:
+                log.warning(f"Can't read max_allowed_packet, assuming 4 MB: {e}")
+                self._max_allowed_packet = 4 * 1024**2
+        return self._max_allowed_packet
+
+    def _insert_native(
+        self,
+        name: str,
+        pdf: pd.DataFrame,
+        table: str,
+        schema: str = None,
+        if_exists: str = "replace",
+        index: bool = False,
+        connections: int = 1,
+        max_rows: int = None,
+        **kwargs: dict,
+    ) -> str:
+        """``to_sql(method="multi")`` through ``InsertWriter``: the table is created
+        from the column types pandas infers on the whole frame, the rows go in
+        packet-sized executemany batches of at most ``max_rows`` rows over
+        ``connections`` connections. One connection writes all rows or none,
+        see ``samesyslib.inserts`` for what several connections give up.
+        """
+        import pandas as pd
+        from sqlalchemy import inspect
+
+        from samesyslib.inserts import InsertWriter
+
+        if if_exists not in ("fail", "replace", "append"):
+            raise ValueError(f"'{if_exists}' is not valid for if_exists")
+
+        with metrics.operation(name, shard=self._shard, table=table) as op:
+            op.rows = pdf.shape[0]
+            try:
+                if index:
+                    pdf = pdf.reset_index()
+                target = f"{schema}.{table}" if schema else table
+                with op.phase("create"):
+                    exists = inspect(self.engine).has_table(table, schema=schema)
+                    if exists and if_exists == "fail":
+                        raise ValueError(f"Table '{target}' already exists.")
+                    if exists and if_exists == "replace":
+                        self.engine.execute(f"DROP TABLE {target}")
+                        self.forget_table_schema(table, schema)
+                    if not exists or if_exists == "replace":
+                        self.engine.execute(
+                            pd.io.sql.get_schema(
+                                pdf, table, con=self.engine, schema=schema
+                            )
+                        )
+                with op.phase("insert"):
+                    InsertWriter(
+                        self, table, schema, connections, max_rows=max_rows
+                    ).write(pdf)
+            except Exception as e:
+                op.error = str(e)
+                log.error("SQL EXCEPTION: {}".format(str(e)))
+                raise
         return table
 
     @timing
@@ -168,10 +792,98 @@ class DB(POptimiseDataTypesMixin):
         with self.engine.begin() as conn:
             conn.execute(sql)
 
+    def _multi_statement_connection(self):
+        """Open a DBAPI connection, outside of the pool, that accepts several
+        statements per query.
+        """
+        cargs, cparams = self.engine.dialect.create_connect_args(self.engine.url)
+        cparams.update(self._connect_args)
+        cparams["client_flag"] = cparams.get("client_flag", 0) | CLIENT_MULTI_STATEMENTS
+        return self.engine.dialect.dbapi.connect(*cargs, **cparams)
+
+    @timing
+    def run_script(
+        self,
+        script: Union[str, Path, Iterable[str]],
+        batch_size: int = 50,
+        **kwargs: dict,
+    ) -> pd.DataFrame:
+        """Run an SQL script sending up to ``batch_size`` statements per round trip.
+
+        Args:
+            script (str, Path, Iterable[str]): path to an .sql file, script text
+                or already split statements
+            batch_size (int): number of statements sent in one round trip
+
+        Returns:
+            pd.DataFrame: statement, affected rows and seconds for every statement
+
+        Examples:
+
+            .. code-block:: python
+
+                timings = db.run_script(Path("sql/nightly_etl.sql"))
+                timings.sort_values("seconds").tail()
+        """
+        import pandas as pd
+
+        verbose = False
+        if kwargs is not None:
+            if "verbose" in kwargs.keys():
+                verbose = kwargs["verbose"]
+
+        if isinstance(script, Path) or (
+            isinstance(script, str) and os.path.isfile(script)
+        ):
+            with open(script, "r") as reader:
+                statements = list(iter_sql_statements(reader))
+        elif isinstance(script, str):
+            statements = list(iter_sql_statements(script))
+        else:
+            statements = list(script)
+
+        timings = []
+        conn = self._multi_statement_connection()
+        try:
+            cursor = conn.cursor()
+            for offset in range(0, len(statements), batch_size):
+                batch = statements[offset : offset + batch_size]
+                start = time()
+                position = 0
+                try:
+                    # a delimiter on a line of its own never ends up inside the
+                    # trailing comment of a statement. The server answers statement
+                    # by statement, the time between two result sets is the run
+                    # time of the statement
+                    cursor.execute("\n;\n".join(batch))
+                    while True:
+                        end = time()
+                        timings.append((batch[position], cursor.rowcount, end - start))
+                        if verbose:
+                            log.info(
+                                f"Executed in {round(end - start, 1)} s:\n{batch[position]}"
+                            )
+                        start = end
+                        position += 1
+                        if not cursor.nextset():
+                            break
+                except Exception as e:
+                    log.error(
+                        f"SQL EXCEPTION: {str(e)}\nIn statement:\n{batch[position]}"
+                    )
+                    raise
+                conn.commit()
+        finally:
+            conn.close()
+
+        return pd.DataFrame(timings, columns=["statement", "rows", "seconds"])
+
     @timing
     def send_append(
         self, pdf: pd.DataFrame, table: str = None, schema: str = None, **kwargs
     ) -> str:
+        import pandas as pd
+
         verbose = False
         if kwargs is not None:
             if "verbose" in kwargs.keys():
@@ -180,38 +892,48 @@ class DB(POptimiseDataTypesMixin):
         table_name = table
         schema = schema or self._schema
 
-        try:
-            with self.engine.connect() as conn:
-                conn.execute(f"USE {schema}")
+        with metrics.operation("send_append", shard=self._shard, table=table) as op:
+            op.rows = pdf.shape[0]
+            try:
+                exists = self.table_schema(table_name, schema) is not None
+                with self.engine.connect() as conn:
+                    if not exists:
+                        conn.execute(f"USE {schema}")
+                        with op.phase("create"):
+                            create_stmt = pd.io.sql.get_schema(
+                                pdf, table_name, con=self.engine
+                            )
+                            if verbose:
+                                log.info(f"Executing query:\n{create_stmt}")
+                            conn.execute(create_stmt)
+                        self.forget_table_schema(table_name, schema)
 
-                if not conn.execute(f'show tables like "{table_name}"'):
-                    create_stmt = pd.io.sql.get_schema(pdf, table_name, con=self.engine)
-                    if verbose:
-                        log.info(f"Executing query:\n{create_stmt}")
-                    conn.execute(create_stmt)
-
-                with tempfile.NamedTemporaryFile() as tf:
-                    pdf.to_csv(
-                        tf.name,
-                        encoding="utf-8",
-                        header=True,
-                        doublequote=True,
-                        sep=",",
-                        index=False,
-                        na_rep="NULL",
-                    )
+                    with tempfile.NamedTemporaryFile() as tf:
+                        with op.phase("serialize"):
+                            pdf.to_csv(
+                                tf.name,
+                                encoding="utf-8",
+                                header=True,
+                                doublequote=True,
+                                sep=",",
+                                index=False,
+                                na_rep="NULL",
+                            )
+                        op.bytes = os.path.getsize(tf.name)
 
-                    load_stmt = f"""
-                    LOAD DATA LOCAL INFILE '{tf.name}'
-                    INTO TABLE {schema}.{table_name} FIELDS TERMINATED BY ',' ENCLOSED BY '\"'
-                    IGNORE 1 LINES;
-                    """
-                    if verbose:
-                        log.info(f"Executing query:\n{load_stmt}")
-                    rows = conn.execute(load_stmt)
+                        load_stmt = f"""
+                        LOAD DATA LOCAL INFILE '{tf.name}'
+                        INTO TABLE {schema}.{table_name} FIELDS TERMINATED BY ',' ENCLOSED BY '\"'
+                        IGNORE 1 LINES;
+                        """
+                        if verbose:
+                            log.info(f"Executing query:\n{load_stmt}")
+                        with op.phase("load"):
+                            rows = conn.execute(load_stmt)
 
-        except Exception as e:
-            log.error(f"SQL EXCEPTION: {str(e)}")
+            except Exception as e:
+                op.error = str(e)
+                log.error(f"SQL EXCEPTION: {str(e)}")
 
         return f"{schema}.{table}"
 
@@ -223,12 +945,32 @@ class DB(POptimiseDataTypesMixin):
         schema: str = None,
         if_exists: str = "replace",
         index: bool = False,
+        resumable: bool = False,
+        compact_types: bool = False,
+        primary_key: Union[str, list] = None,
+        indexes: list = None,
         **kwargs: dict,
     ) -> str:
+        """Replace ``table`` with ``pdf`` through a staging table and LOAD DATA
+
+        With ``compact_types`` the staging table gets the narrowest types holding
+        the data, see ``create_table_statement``, instead of TEXT and BIGINT;
+        ``enum_max_values`` and ``max_varchar`` are passed on to it.
+        ``primary_key`` is created with the table, the secondary ``indexes`` once
+        the data is loaded, before the staging table replaces ``table``. Both
+        imply ``compact_types``.
+        """
         if if_exists != "replace":
             return self.send_append(
                 pdf, table=table, if_exists=if_exists, index=index, **kwargs
             )
+        keys = dict(
+            compact_types=compact_types, primary_key=primary_key, indexes=indexes
+        )
+        if resumable:
+            return self._send_resumable(
+                pdf, table=table, schema=schema, **keys, **kwargs
+            )
 
         verbose = False
         if kwargs is not None:
@@ -238,48 +980,278 @@ class DB(POptimiseDataTypesMixin):
         tmp_prefix = "_tmp"
         schema = schema or self._schema
 
-        try:
-            with self.engine.connect() as conn:
-                query = f"DROP TABLE IF EXISTS {schema}.{table}, {schema}.{table + tmp_prefix};"
-                if verbose:
-                    log.info(f"Executing query:\n{query}")
-                conn.execute(query)
-                with tempfile.NamedTemporaryFile() as tf:
-                    pdf.to_csv(
-                        tf.name,
-                        encoding="utf-8",
-                        header=True,
-                        chunksize=300000,
-                        doublequote=True,
-                        sep=",",
-                        index=False,
-                        na_rep="NULL",
-                    )
-                    conn.execute(f"USE {schema};")
-                    create_stmt = pd.io.sql.get_schema(
-                        pdf, table + tmp_prefix, con=self.engine
-                    )
+        with metrics.operation("send", shard=self._shard, table=table) as op:
+            op.rows = pdf.shape[0]
+            try:
+                with self.engine.connect() as conn:
+                    query = f"DROP TABLE IF EXISTS {schema}.{table}, {schema}.{table + tmp_prefix};"
                     if verbose:
-                        log.info(f"Executing query:\n{create_stmt}")
-                    conn.execute(create_stmt)
+                        log.info(f"Executing query:\n{query}")
+                    conn.execute(query)
+                    with tempfile.NamedTemporaryFile() as tf:
+                        with op.phase("serialize"):
+                            pdf.to_csv(
+                                tf.name,
+                                encoding="utf-8",
+                                header=True,
+                                chunksize=300000,
+                                doublequote=True,
+                                sep=",",
+                                index=False,
+                                na_rep="NULL",
+                            )
+                        op.bytes = os.path.getsize(tf.name)
+                        conn.execute(f"USE {schema};")
+                        with op.phase("create"):
+                            create_stmt = self._create_statement(
+                                pdf, table + tmp_prefix, **keys, **kwargs
+                            )
+                            if verbose:
+                                log.info(f"Executing query:\n{create_stmt}")
+                            conn.execute(create_stmt)
 
-                    load_stmt = f"""
-                    LOAD DATA LOCAL INFILE '{tf.name}'
-                    INTO TABLE {schema}.{table+tmp_prefix}
-                    FIELDS TERMINATED BY ',' ENCLOSED BY '\"' IGNORE 1 LINES;
-                    """
-                    if verbose:
-                        log.info(f"Executing query:\n{load_stmt}")
-                    rows = conn.execute(load_stmt)
+                        load_stmt = f"""
+                        LOAD DATA LOCAL INFILE '{tf.name}'
+                        INTO TABLE {schema}.{table+tmp_prefix}
+                        FIELDS TERMINATED BY ',' ENCLOSED BY '\"' IGNORE 1 LINES;
+                        """
+                        if verbose:
+                            log.info(f"Executing query:\n{load_stmt}")
+                        with op.phase("load"):
+                            rows = conn.execute(load_stmt)
+                        if indexes:
+                            with op.phase("index"):
+                                conn.execute(
+                                    add_indexes_statement(
+                                        f"{schema}.{table + tmp_prefix}", indexes
+                                    )
+                                )
+                        with op.phase("rename"):
+                            conn.execute(
+                                f"RENAME TABLE {schema}.{table + tmp_prefix} TO {schema}.{table};"
+                            )
+                log.info(
+                    f"Successfully loaded csv into table {schema}.{table} {rows.rowcount} rows."
+                )
+
+            except Exception as e:
+                op.error = str(e)
+                log.error(f"SQL EXCEPTION: {str(e)}")
+            finally:
+                # after the table is replaced or dropped, a lookup made meanwhile
+                # would cache the old columns
+                self.forget_table_schema(table, schema)
+
+        return f"{schema}.{table}"
+
+    def _create_statement(
+        self,
+        pdf: pd.DataFrame,
+        table: str,
+        compact_types: bool = False,
+        primary_key: Union[str, list] = None,
+        indexes: list = None,
+        enum_max_values: int = 0,
+        max_varchar: int = 4096,
+        **kwargs: dict,
+    ) -> str:
+        import pandas as pd
+
+        if compact_types or primary_key or indexes:
+            return create_table_statement(
+                pdf,
+                table,
+                primary_key=primary_key,
+                enum_max_values=enum_max_values,
+                max_varchar=max_varchar,
+            )
+        return pd.io.sql.get_schema(pdf, table, con=self.engine)
+
+    def _send_resumable(
+        self,
+        pdf: pd.DataFrame,
+        table: str,
+        schema: str = None,
+        chunk_rows: int = 1000000,
+        load_id: str = None,
+        retries: int = 3,
+        retry_wait: float = 5.0,
+        **kwargs: dict,
+    ) -> str:
+        """Replace ``table`` with ``pdf`` loaded in numbered chunks of ``chunk_rows``.
+
+        Every chunk is loaded into the staging table in the same transaction as its
+        checkpoint row in ``LOAD_CHECKPOINT_TABLE``. A failing chunk is retried
+        ``retries`` times; when it still fails the staging table and checkpoints are
+        kept, and sending the same frame again with the same ``load_id`` skips the
+        chunks that already landed. The staging table replaces ``table`` once all
+        chunks are in.
+
+        ``load_id`` defaults to a hash of the target, the columns and every row of
+        the frame. A failed load raises once logged, the frame sent again resumes it.
+        Checkpoints record the rows of their chunk, a load sent again with another
+        ``chunk_rows`` starts over.
+        """
+        import pandas as pd
+        from sqlalchemy import inspect
+        from sqlalchemy.sql import text
+
+        verbose = False
+        if kwargs is not None:
+            if "verbose" in kwargs.keys():
+                verbose = kwargs["verbose"]
+
+        schema = schema or self._schema
+        staging = f"{schema}.{table}_tmp"
+        checkpoints = f"{schema}.{LOAD_CHECKPOINT_TABLE}"
+        if load_id is None:
+            digest = hashlib.md5(f"{list(pdf.columns)}".encode())
+            try:
+                hashes = pd.util.hash_pandas_object(pdf, index=False)
+            except TypeError:
+                # unhashable cells, lists or dicts, are hashed as they are written
+                hashes = pd.util.hash_pandas_object(pdf.astype(str), index=False)
+            digest.update(hashes.to_numpy())
+            load_id = f"{schema}.{table}:{digest.hexdigest()}"
+        same_load = text(f"DELETE FROM {checkpoints} WHERE load_id = :load_id")
+        n_chunks = max(1, -(-pdf.shape[0] // chunk_rows))
+
+        def chunk_bounds(chunk_id):
+            """first row and number of rows of a chunk"""
+            start = chunk_id * chunk_rows
+            return start, max(0, min(chunk_rows, pdf.shape[0] - start))
+
+        with metrics.operation("send", shard=self._shard, table=table) as op:
+            op.rows = pdf.shape[0]
+            op.bytes = 0
+            try:
+                with self.engine.connect() as conn:
                     conn.execute(
-                        f"RENAME TABLE {schema}.{table + tmp_prefix} TO {schema}.{table};"
+                        f"""CREATE TABLE IF NOT EXISTS {checkpoints} (
+                            load_id VARCHAR(255) NOT NULL,
+                            chunk_id INT NOT NULL,
+                            first_row BIGINT NOT NULL,
+                            `rows` BIGINT NOT NULL,
+                            loaded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                            PRIMARY KEY (load_id, chunk_id)
+                        );"""
                     )
-            log.info(
-                f"Successfully loaded csv into table {schema}.{table} {rows.rowcount} rows."
-            )
+                    landed = {
+                        row[0]: (row[1], row[2])
+                        for row in conn.execute(
+                            text(
+                                f"SELECT chunk_id, first_row, `rows` "
+                                f"FROM {checkpoints} WHERE load_id = :load_id"
+                            ),
+                            load_id=load_id,
+                        )
+                    }
+                    done = set(landed)
+                    staged = inspect(conn).has_table(f"{table}_tmp", schema=schema)
+                    if done and not staged:
+                        log.info(f"Staging table {staging} is gone, restarting load")
+                        done = set()
+                    if done and any(
+                        bounds != chunk_bounds(chunk_id)
+                        for chunk_id, bounds in landed.items()
+                    ):
+                        # chunks of another chunk_rows would skip or repeat rows
+                        log.info(
+                            f"Checkpoints of load {load_id} don't match "
+                            f"chunk_rows={chunk_rows}, restarting load"
+                        )
+                        done = set()
+                    if done:
+                        log.info(
+                            f"Resuming load {load_id}: "
+                            f"{len(done)} of {n_chunks} chunks already loaded"
+                        )
+                    else:
+                        conn.execute(same_load, load_id=load_id)
+                        conn.execute(f"DROP TABLE IF EXISTS {staging};")
+                        conn.execute(f"USE {schema};")
+                        with op.phase("create"):
+                            create_stmt = self._create_statement(
+                                pdf, f"{table}_tmp", **kwargs
+                            )
+                            if verbose:
+                                log.info(f"Executing query:\n{create_stmt}")
+                            conn.execute(create_stmt)
 
-        except Exception as e:
-            log.error(f"SQL EXCEPTION: {str(e)}")
+                for chunk_id in range(n_chunks):
+                    if chunk_id in done:
+                        continue
+                    start, _ = chunk_bounds(chunk_id)
+                    chunk = pdf.iloc[start : start + chunk_rows]
+                    for attempt in range(retries + 1):
+                        try:
+                            with tempfile.NamedTemporaryFile() as tf:
+                                with op.phase("serialize"):
+                                    chunk.to_csv(
+                                        tf.name,
+                                        encoding="utf-8",
+                                        header=True,
+                                        doublequote=True,
+                                        sep=",",
+                                        index=False,
+                                        na_rep="NULL",
+                                    )
+                                with op.phase("load"), self.engine.begin() as tx:
+                                    tx.execute(
+                                        f"""
+                                        LOAD DATA LOCAL INFILE '{tf.name}'
+                                        INTO TABLE {staging}
+                                        FIELDS TERMINATED BY ',' ENCLOSED BY '\"'
+                                        IGNORE 1 LINES;
+                                        """
+                                    )
+                                    tx.execute(
+                                        text(
+                                            f"INSERT INTO {checkpoints} "
+                                            f"(load_id, chunk_id, first_row, "
+                                            f"`rows`) VALUES (:load_id, :chunk_id, "
+                                            f":first_row, :rows)"
+                                        ),
+                                        load_id=load_id,
+                                        chunk_id=chunk_id,
+                                        first_row=start,
+                                        rows=chunk.shape[0],
+                                    )
+                                op.bytes += os.path.getsize(tf.name)
+                            break
+                        except Exception as e:
+                            if attempt == retries:
+                                raise
+                            log.warning(
+                                f"Chunk {chunk_id} of load {load_id} failed, "
+                                f"retry {attempt + 1} of {retries}: {str(e)}"
+                            )
+                            sleep(retry_wait * 2**attempt)
+                    if verbose:
+                        log.info(f"Loaded chunk {chunk_id + 1} of {n_chunks}")
+
+                indexes = kwargs.get("indexes")
+                if indexes:
+                    with op.phase("index"):
+                        self.engine.execute(add_indexes_statement(staging, indexes))
+                with op.phase("rename"), self.engine.connect() as conn:
+                    conn.execute(f"DROP TABLE IF EXISTS {schema}.{table};")
+                    conn.execute(f"RENAME TABLE {staging} TO {schema}.{table};")
+                    conn.execute(same_load, load_id=load_id)
+                log.info(
+                    f"Successfully loaded {n_chunks} chunks into table "
+                    f"{schema}.{table} {pdf.shape[0]} rows."
+                )
+
+            except Exception as e:
+                op.error = str(e)
+                log.error(
+                    f"SQL EXCEPTION: {str(e)}\n"
+                    f"Send again with load_id='{load_id}' to resume the load"
+                )
+                raise
+            finally:
+                self.forget_table_schema(table, schema)
 
         return f"{schema}.{table}"
 
@@ -288,16 +1260,20 @@ class DB(POptimiseDataTypesMixin):
         self, df: pd.DataFrame, table: str, schema: str = None, **kwargs: dict
     ) -> str:
         schema = schema or self._schema
-        with tempfile.NamedTemporaryFile() as tf:
-            df.to_csv(
-                tf.name,
-                encoding="utf-8",
-                header=True,
-                doublequote=True,
-                sep=",",
-                index=False,
-                na_rep="NULL",
-            )
+        op_context = metrics.operation("send_replace", shard=self._shard, table=table)
+        with op_context as op, tempfile.NamedTemporaryFile() as tf:
+            op.rows = df.shape[0]
+            with op.phase("serialize"):
+                df.to_csv(
+                    tf.name,
+                    encoding="utf-8",
+                    header=True,
+                    doublequote=True,
+                    sep=",",
+                    index=False,
+                    na_rep="NULL",
+                )
+            op.bytes = os.path.getsize(tf.name)
 
             load_stmt = f"""
             LOAD DATA LOCAL INFILE '{tf.name}'
@@ -305,12 +1281,57 @@ class DB(POptimiseDataTypesMixin):
             IGNORE 1 LINES;
             """
             with self.engine.connect() as conn:
-                rows = conn.execute(load_stmt)
+                with op.phase("load"):
+                    rows = conn.execute(load_stmt)
                 log.info(f"ROWS INSERTED: {rows.rowcount}")
         return f"{schema}.{table}"
 
+    def table_schema(
+        self, table: str, schema: str = None, refresh: bool = False
+    ) -> Union[dict, None]:
+        """Columns of ``table`` in table order, as ``{name: (data_type, max_length)}``
+
+        Read from ``information_schema`` once per table and cached on the connection,
+        None when the table doesn't exist. ``send`` forgets the tables it replaces,
+        call ``forget_table_schema`` or pass ``refresh=True`` after altering a table
+        any other way.
+        """
+        schema = schema or self._schema
+        if self._schema_cache is None:
+            self._schema_cache = {}
+        key = (schema, table)
+        if refresh or key not in self._schema_cache:
+            rows = self.engine.execute(
+                f"""SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH
+                    FROM information_schema.COLUMNS
+                    WHERE TABLE_SCHEMA = '{schema}' AND TABLE_NAME = '{table}'
+                    ORDER BY ORDINAL_POSITION"""
+            ).fetchall()
+            if not rows:
+                self._schema_cache.pop(key, None)
+                return None
+            self._schema_cache[key] = {
+                name: (data_type.lower(), length) for name, data_type, length in rows
+            }
+        return self._schema_cache[key]
+
+    def forget_table_schema(self, table: str, schema: str = None):
+        if self._schema_cache is not None:
+            self._schema_cache.pop((schema or self._schema, table), None)
+
+    def appender(self, table: str, schema: str = None, **kwargs: dict) -> Appender:
+        """Micro-batching writer appending many small frames to ``table``
+
+        See ``samesyslib.appender.Appender`` for the flush thresholds.
+        """
+        from samesyslib.appender import Appender
+
+        return Appender(self, table, schema=schema, **kwargs)
+
     def size(self, schema: str = None) -> pd.DataFrame:
         """Create a dataframe of sizes of tables"""
+        import pandas as pd
+
         if schema:
             condition = f'''TABLE_SCHEMA = "{schema}"'''
         else:
@@ -328,7 +1349,8 @@ class DB(POptimiseDataTypesMixin):
                     DESC;
                     """
         try:
-            df = pd.read_sql_query(query, self.engine)
+            with self._read_connection() as conn:
+                df = pd.read_sql_query(query, conn)
             return df
         except Exception as e:
             log.error(f"SQL EXCEPTION: {str(e)}")
@@ -363,18 +1385,39 @@ class DB(POptimiseDataTypesMixin):
         method: str = "multi",
         **kwargs: dict,
     ) -> pd.DataFrame:
-        try:
-            pdf.to_sql(
+        """Write ``pdf`` to ``table`` like ``send_single``, ``InsertWriter`` batches
+        for the default ``method="multi"``.
+
+        Failures are logged and raised, whatever the ``method``.
+        """
+        if method == "multi":
+            return self._insert_native(
+                "upsert",
+                pdf,
                 table,
-                self.engine,
-                chunksize=chunksize,
-                if_exists=if_exists,
-                schema=schema,
-                index=index,
-                method=method,
+                schema,
+                if_exists,
+                index,
+                max_rows=chunksize,
+                **kwargs,
             )
-        except Exception as e:
-            log.error("SQL EXCEPTION: {}".format(str(e)))
+        with metrics.operation("upsert", shard=self._shard, table=table) as op:
+            op.rows = pdf.shape[0]
+            try:
+                with op.phase("insert"):
+                    pdf.to_sql(
+                        table,
+                        self.engine,
+                        chunksize=chunksize,
+                        if_exists=if_exists,
+                        schema=schema,
+                        index=index,
+                        method=method,
+                    )
+            except Exception as e:
+                op.error = str(e)
+                log.error("SQL EXCEPTION: {}".format(str(e)))
+                raise
         return table
 
     def get_shard(self):
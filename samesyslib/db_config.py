@@ -5,8 +5,22 @@ from pathlib import Path
 from samesyslib.utils import load_config
 
 
-DEFAULT_ENV = os.getenv("DB_ENVIRONMENT", "dev")
-CONFIG_PATH = os.getenv("CONFIG_PATH", None)
+def default_env():
+    return os.getenv("DB_ENVIRONMENT", "dev")
+
+
+def config_path():
+    return os.getenv("CONFIG_PATH", None)
+
+
+def __getattr__(name):
+    # DEFAULT_ENV and CONFIG_PATH are read from the environment when they are used,
+    # not when the module is imported
+    if name == "DEFAULT_ENV":
+        return default_env()
+    if name == "CONFIG_PATH":
+        return config_path()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class DBParams(object):
@@ -19,17 +33,30 @@ class DBParams(object):
     _shard = None
     parameters = {}
     connect_args = {}
+    # read replicas, dicts overriding host, port, login and password of the primary
+    replicas = []
+    replica_max_lag = 30.0
+    replica_check_interval = 10.0
 
     def __init__(self, **params):
         self.__dict__.update(params)
 
 
 class DBConfig(object):
-    def __init__(self, env=None, schema=None, bi=False, parameters={}, connect_args={}):
+    def __init__(
+        self,
+        env=None,
+        schema=None,
+        bi=False,
+        parameters={},
+        connect_args={},
+        replicas=None,
+    ):
         self._schema = schema
         self._env = env
         self._connect_args = connect_args
         self._parameters = parameters
+        self._replicas = replicas
 
         self.db_connection = None
 
@@ -37,17 +64,19 @@ class DBConfig(object):
         self._proceed()
 
     def _change_env(self, env):
-        self._env = env or DEFAULT_ENV
+        self._env = env or default_env()
 
     def _load_from_config(self):
-        if CONFIG_PATH is None:
+        if config_path() is None:
             raise Exception("CONFIG_PATH is not defined")
 
-        path = Path.home() / Path(CONFIG_PATH)
+        path = Path.home() / Path(config_path())
         cred = load_config(path)
         conf = cred[self._env]
         conf["parameters"] = self._parameters
         conf["connect_args"] = self._connect_args
+        if self._replicas is not None:
+            conf["replicas"] = self._replicas
         self.db_connection = DBParams(**conf)
 
     def _proceed(self):
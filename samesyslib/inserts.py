@@ -0,0 +1,259 @@
+"""Multi-row INSERTs sized to ``max_allowed_packet``, for servers without LOAD DATA.
+
+``DataFrame.to_sql(method="multi")`` renders one bound parameter per value through
+SQLAlchemy and sends ``chunksize`` rows per statement whatever their width, which
+is slow and overflows ``max_allowed_packet`` on wide rows. ``InsertWriter``
+converts the frame column by column with NumPy, cuts it into batches of about
+``max_allowed_packet`` bytes and hands every batch to the driver's
+``executemany``, which pymysql packs into multi-row INSERTs no longer than the
+packet.
+
+With ``connections=2`` a second connection sends the next batch while the first
+still waits on the server, and the main thread converts the batch after that.
+The batches of every connection go in one transaction, committed once all of
+them are sent; a failed batch rolls every connection back and raises. A single
+connection writes all rows or none. Pipelining over several connections gives
+that up: their transactions commit one after the other, a failing commit leaves
+the rows of the connections committed before it in the table.
+
+Examples:
+
+    .. code-block:: python
+
+        InsertWriter(db, "sales", connections=2).write(sales)
+"""
+
+from __future__ import annotations
+
+import logging
+import queue
+from typing import TYPE_CHECKING, Iterator, List
+
+from samesyslib import metrics
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+    from samesyslib.db import DB
+
+log = logging.getLogger(__name__)
+# no log by default unless log system gets configured in the main code
+log.addHandler(logging.NullHandler())
+
+# bytes of a statement that aren't row values: INSERT INTO ... VALUES and headers
+STATEMENT_MARGIN = 16 * 1024
+# rendered width of a value of each dtype kind, escaped strings are measured
+KIND_BYTES = {"b": 1, "i": 20, "u": 20, "f": 24, "M": 28, "m": 28}
+# characters the driver escapes with a backslash in string literals
+ESCAPED_CHARACTERS = r"[\\'\"\r\n\x00\x1a]"
+
+
+def row_bytes(pdf: pd.DataFrame) -> np.ndarray:
+    """Estimated bytes of every row rendered as ``(v1, v2, ...),``
+
+    Strings count their UTF-8 bytes plus a backslash per escaped character.
+    """
+    import numpy as np
+
+    sizes = np.full(pdf.shape[0], 3 + pdf.shape[1], dtype=np.int64)
+    for _, col in pdf.items():
+        width = KIND_BYTES.get(col.dtype.kind)
+        if width is not None:
+            sizes += width
+            continue
+        text = col.astype(str)
+        sizes += text.str.encode("utf-8").str.len().to_numpy(dtype=np.int64) + 2
+        sizes += text.str.count(ESCAPED_CHARACTERS).to_numpy(dtype=np.int64)
+    return sizes
+
+
+def batch_bounds(sizes: np.ndarray, budget: int, max_rows: int = None) -> List[tuple]:
+    """``(start, stop)`` of consecutive rows adding up to at most ``budget`` bytes
+    and ``max_rows`` rows, a row wider than the budget gets a batch of its own.
+    """
+    import numpy as np
+
+    ends = np.cumsum(sizes)
+    bounds = []
+    start = 0
+    while start < len(sizes):
+        before = ends[start - 1] if start else 0
+        stop = int(np.searchsorted(ends, before + budget, side="right"))
+        stop = max(stop, start + 1)
+        if max_rows:
+            stop = min(stop, start + max_rows)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+
+def column_values(col: pd.Series) -> list:
+    """Values of ``col`` as Python objects the driver can escape, None for NULL"""
+    import numpy as np
+
+    if not isinstance(col.dtype, np.dtype):
+        return col.to_numpy(dtype=object, na_value=None).tolist()
+    values = col.to_numpy()
+    kind = values.dtype.kind
+    if kind in "iub":
+        return values.tolist()
+    if kind == "f":
+        missing = np.isnan(values)
+    elif kind in "mM":
+        missing = np.isnat(values)
+        if kind == "M":
+            values = np.datetime_as_string(values, unit="us")
+        else:
+            values = values.astype(str)
+    else:
+        missing = col.isna().to_numpy()
+    if not missing.any():
+        return values.tolist()
+    values = values.astype(object)
+    values[missing] = None
+    return values.tolist()
+
+
+class InsertWriter:
+    """Writes frames to an existing table with packet-sized executemany batches.
+
+    Args:
+        conn (DB): database connection
+        table (str): target table
+        schema (str): schema of the table, the connection schema by default
+        connections (int): connections sending batches at the same time, more
+            than one gives up the all or nothing write
+        max_rows (int): rows per batch at most, batches are only cut by size when
+            None
+    """
+
+    def __init__(
+        self,
+        conn: DB,
+        table: str,
+        schema: str = None,
+        connections: int = 1,
+        max_rows: int = None,
+    ):
+        self.conn = conn
+        self.table = table
+        self.schema = schema or conn._schema
+        self.connections = max(1, connections)
+        self.max_rows = max_rows
+
+    def _statement(self, columns: list) -> str:
+        marker = "?" if self.conn.engine.dialect.paramstyle == "qmark" else "%s"
+        names = ", ".join(f"`{name}`" for name in columns)
+        markers = ", ".join([marker] * len(columns))
+        target = f"`{self.table}`"
+        if self.schema:
+            target = f"`{self.schema}`.{target}"
+        return f"INSERT INTO {target} ({names}) VALUES ({markers})"
+
+    def _send(self, idle: queue.Queue, statement: str, rows: list, packet: int) -> int:
+        """executemany ``rows`` on an idle connection, left uncommitted"""
+        connection = idle.get()
+        try:
+            cursor = connection.cursor()
+            try:
+                if hasattr(cursor, "max_stmt_length"):
+                    # pymysql splits executemany into INSERTs of at most this length
+                    cursor.max_stmt_length = packet - STATEMENT_MARGIN
+                cursor.executemany(statement, rows)
+            finally:
+                cursor.close()
+        finally:
+            idle.put(connection)
+        return len(rows)
+
+    def batches(self, pdf: pd.DataFrame, budget: int) -> Iterator[tuple]:
+        """Rows of ``pdf`` as lists of tuples of about ``budget`` bytes, with
+        their estimated size.
+        """
+        sizes = row_bytes(pdf)
+        for start, stop in batch_bounds(sizes, budget, self.max_rows):
+            block = pdf.iloc[start:stop]
+            rows = list(zip(*(column_values(col) for _, col in block.items())))
+            yield rows, int(sizes[start:stop].sum())
+
+    def write(self, pdf: pd.DataFrame) -> int:
+        """Insert the rows of ``pdf``, all or none over a single connection,
+        returns the number of rows written
+        """
+        packet = self.conn.max_allowed_packet()
+        budget = packet - STATEMENT_MARGIN
+        statement = self._statement(list(pdf.columns))
+        idle = queue.Queue()
+        connections = []
+        op_context = metrics.operation(
+            "insert_writer", shard=self.conn._shard, table=self.table
+        )
+        with op_context as op:
+            op.rows = pdf.shape[0]
+            op.bytes = 0
+            try:
+                for _ in range(self.connections):
+                    connections.append(self.conn.engine.raw_connection())
+                    idle.put(connections[-1])
+                written = self._write_batches(op, pdf, budget, statement, idle, packet)
+                with op.phase("commit"):
+                    for connection in connections:
+                        connection.commit()
+                return written
+            except BaseException:
+                for connection in connections:
+                    try:
+                        connection.rollback()
+                    except Exception as e:
+                        log.warning(f"Rollback of {self.table} failed: {str(e)}")
+                raise
+            finally:
+                for connection in connections:
+                    connection.close()
+
+    def _write_batches(
+        self,
+        op: metrics.Operation,
+        pdf: pd.DataFrame,
+        budget: int,
+        statement: str,
+        idle: queue.Queue,
+        packet: int,
+    ) -> int:
+        from concurrent.futures import ThreadPoolExecutor
+
+        written = 0
+        if self.connections == 1:
+            for rows in self._timed_batches(op, pdf, budget):
+                with op.phase("insert"):
+                    written += self._send(idle, statement, rows, packet)
+            return written
+
+        with ThreadPoolExecutor(
+            max_workers=self.connections,
+            thread_name_prefix="samesyslib-insert",
+        ) as executor:
+            in_flight = []
+            for rows in self._timed_batches(op, pdf, budget):
+                if len(in_flight) == self.connections:
+                    with op.phase("insert"):
+                        written += in_flight.pop(0).result()
+                in_flight.append(
+                    executor.submit(self._send, idle, statement, rows, packet)
+                )
+            with op.phase("insert"):
+                for future in in_flight:
+                    written += future.result()
+        return written
+
+    def _timed_batches(self, op: metrics.Operation, pdf: pd.DataFrame, budget: int):
+        batches = self.batches(pdf, budget)
+        while True:
+            with op.phase("convert"):
+                batch = next(batches, None)
+            if batch is None:
+                return
+            rows, size = batch
+            op.bytes += size
+            yield rows
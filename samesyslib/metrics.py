@@ -0,0 +1,199 @@
+"""In-process metrics of samesyslib database operations.
+
+Every instrumented call (``DB.get``, ``DB.send*``, ``DB.upsert``, shard fan-out)
+records one event holding its rows, bytes, total duration and per-phase durations.
+Events are aggregated into histograms keyed by operation and metric, and handed to
+every registered exporter.
+
+Phases of reads are ``execute``, ``fetch``, ``frame_build`` and ``dtype_optimize``.
+Phases of LOAD DATA writes are ``serialize``, ``create``, ``load`` and ``rename``;
+``load`` covers both the transfer of the file and the server side insert, LOAD DATA
+LOCAL streams the file while the server inserts it, so the two can't be told apart
+from the client.
+
+Examples:
+
+    .. code-block:: python
+
+        from samesyslib import metrics
+
+        metrics.add_exporter(lambda event: statsd.timing(event["operation"], event["seconds"]))
+        db.get("SELECT * FROM sales")
+        metrics.snapshot()["get"]["phase.fetch"]["p90"]
+"""
+import logging
+import math
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, List
+
+log = logging.getLogger(__name__)
+# no log by default unless log system gets configured in the main code
+log.addHandler(logging.NullHandler())
+
+# histogram buckets per doubling of the value, quantiles are exact to ~19%
+BUCKETS_PER_OCTAVE = 4
+
+
+class Histogram:
+    """Log-scale histogram of non-negative values, exact count, sum, min and max."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets: Dict[int, int] = {}
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        bucket = (
+            math.floor(math.log2(value) * BUCKETS_PER_OCTAVE) if value > 0 else None
+        )
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile, clipped to max."""
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        seen = self.buckets.get(None, 0)
+        if seen >= rank:
+            return 0.0
+        for bucket in sorted(b for b in self.buckets if b is not None):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(2 ** ((bucket + 1) / BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else math.nan,
+            "max": self.max if self.count else math.nan,
+            "mean": self.sum / self.count if self.count else math.nan,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Operation:
+    """Measurements of one call, filled in while the call runs."""
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self.rows = None
+        self.bytes = None
+        self.error = None
+        self.phases: Dict[str, float] = {}
+        self.seconds = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + perf_counter() - start
+
+    def event(self) -> dict:
+        return {
+            "operation": self.name,
+            "labels": self.labels,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "seconds": self.seconds,
+            "phases": dict(self.phases),
+            "error": self.error,
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe store of histograms and exporters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[str, Histogram]] = {}
+        self._exporters: List[Callable[[dict], None]] = []
+
+    @contextmanager
+    def operation(self, name: str, **labels):
+        op = Operation(name, labels)
+        start = perf_counter()
+        try:
+            yield op
+        except BaseException as e:
+            op.error = op.error or str(e)
+            raise
+        finally:
+            op.seconds = perf_counter() - start
+            self.record(op)
+
+    def record(self, op: Operation):
+        values = {"seconds": op.seconds, "rows": op.rows, "bytes": op.bytes}
+        values.update({f"phase.{name}": sec for name, sec in op.phases.items()})
+        with self._lock:
+            histograms = self._histograms.setdefault(op.name, {})
+            for metric, value in values.items():
+                if value is not None:
+                    histograms.setdefault(metric, Histogram()).observe(value)
+            if op.error is not None:
+                histograms.setdefault("errors", Histogram()).observe(1)
+            exporters = list(self._exporters)
+
+        event = op.event()
+        for exporter in exporters:
+            try:
+                exporter(event)
+            except Exception as e:
+                log.error(f"METRICS EXPORTER EXCEPTION: {str(e)}")
+
+    def snapshot(self) -> dict:
+        """Summaries of all histograms as ``{operation: {metric: summary}}``"""
+        with self._lock:
+            return {
+                name: {metric: h.summary() for metric, h in histograms.items()}
+                for name, histograms in self._histograms.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+    def add_exporter(self, exporter: Callable[[dict], None]):
+        """Call ``exporter(event)`` after every recorded operation."""
+        with self._lock:
+            self._exporters.append(exporter)
+
+    def remove_exporter(self, exporter: Callable[[dict], None]):
+        with self._lock:
+            self._exporters.remove(exporter)
+
+
+def log_exporter(level: int = logging.INFO) -> Callable[[dict], None]:
+    """Exporter writing one log line per operation to the samesyslib.metrics log."""
+
+    def export(event: dict):
+        phases = ", ".join(f"{k}={v:.3f}s" for k, v in event["phases"].items())
+        log.log(
+            level,
+            f"{event['operation']} {event['labels']} rows={event['rows']} "
+            f"bytes={event['bytes']} seconds={event['seconds']:.3f} [{phases}]",
+        )
+
+    return export
+
+
+registry = MetricsRegistry()
+operation = registry.operation
+snapshot = registry.snapshot
+reset = registry.reset
+add_exporter = registry.add_exporter
+remove_exporter = registry.remove_exporter
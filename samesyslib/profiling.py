@@ -0,0 +1,222 @@
+"""Opt-in CPU and memory profiling of samesyslib entry points.
+
+Every method decorated with ``samesyslib.db.timing`` (``DB.get``, ``DB.send*``,
+``DB.execute``, ...) is profiled while profiling is enabled, either for the whole
+process through environment variables or for a block of code with the
+``profiling`` context manager. Each profiled call writes a JSON report with its
+duration, the ``tracemalloc`` peak and the top allocation sites still alive when
+the call returns, plus a ``cProfile`` stats file when CPU profiling is on.
+
+Environment variables, read on the first decorated call:
+
+    SAMESYSLIB_PROFILE         "1" enables profiling
+    SAMESYSLIB_PROFILE_DIR     report directory, a temp directory by default
+    SAMESYSLIB_PROFILE_SAMPLE  fraction of calls profiled, 1 by default
+    SAMESYSLIB_PROFILE_CPU     "1" adds cProfile stats
+    SAMESYSLIB_PROFILE_TOP     number of allocation sites reported, 10 by default
+
+When disabled a decorated call costs one context variable lookup.
+
+``tracemalloc`` keeps a single peak for the whole process. Calls profiled at the
+same time in several threads share it: the peak of such a call covers the
+allocations of the others since the first of them started, and its report says
+so with ``"peak_shared": true``.
+
+Examples:
+
+    .. code-block:: python
+
+        from samesyslib.profiling import profiling
+
+        with profiling(output_dir="/tmp/profiles", cpu=True):
+            df = db.get("SELECT * FROM sales")
+"""
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Optional, Union
+
+log = logging.getLogger(__name__)
+# no log by default unless log system gets configured in the main code
+log.addHandler(logging.NullHandler())
+
+
+class ProfileSettings:
+    def __init__(
+        self,
+        output_dir: Union[str, Path] = None,
+        sample_rate: float = 1.0,
+        cpu: bool = False,
+        top: int = 10,
+    ):
+        self.output_dir = Path(
+            output_dir or Path(tempfile.gettempdir()) / "samesyslib-profiles"
+        )
+        self.sample_rate = sample_rate
+        self.cpu = cpu
+        self.top = top
+
+    @classmethod
+    def from_env(cls) -> Optional["ProfileSettings"]:
+        if os.getenv("SAMESYSLIB_PROFILE", "0") != "1":
+            return None
+        return cls(
+            output_dir=os.getenv("SAMESYSLIB_PROFILE_DIR"),
+            sample_rate=float(os.getenv("SAMESYSLIB_PROFILE_SAMPLE", "1")),
+            cpu=os.getenv("SAMESYSLIB_PROFILE_CPU", "0") == "1",
+            top=int(os.getenv("SAMESYSLIB_PROFILE_TOP", "10")),
+        )
+
+
+_UNSET = object()
+_env_settings = _UNSET
+_settings: ContextVar = ContextVar("samesyslib_profiling", default=None)
+# nested decorated calls (get -> optimize_pandas_datatypes) are profiled once
+_depth = threading.local()
+# tracemalloc is process wide, it runs while at least one call is profiled
+_tracing_lock = threading.Lock()
+# profiled calls running, each with whether another call overlapped it
+_tracing_calls = {}
+_tracing_owned = False
+
+
+def active_settings() -> Optional[ProfileSettings]:
+    global _env_settings
+
+    settings = _settings.get()
+    if settings is not None:
+        return settings
+    if _env_settings is _UNSET:
+        _env_settings = ProfileSettings.from_env()
+    return _env_settings
+
+
+@contextmanager
+def profiling(
+    output_dir: Union[str, Path] = None,
+    sample_rate: float = 1.0,
+    cpu: bool = False,
+    top: int = 10,
+):
+    """Profile the decorated samesyslib calls made inside the block."""
+    token = _settings.set(ProfileSettings(output_dir, sample_rate, cpu, top))
+    try:
+        yield
+    finally:
+        _settings.reset(token)
+
+
+def call(func, args: tuple, kwargs: dict):
+    """Run ``func(*args, **kwargs)``, profiled when profiling is enabled."""
+    settings = active_settings()
+    if settings is None or getattr(_depth, "value", 0):
+        return func(*args, **kwargs)
+    if settings.sample_rate < 1 and random.random() >= settings.sample_rate:
+        return func(*args, **kwargs)
+
+    _depth.value = 1
+    try:
+        return _profile(func, args, kwargs, settings)
+    finally:
+        _depth.value = 0
+
+
+def _start_tracing() -> object:
+    global _tracing_owned
+    import tracemalloc
+
+    call = object()
+    with _tracing_lock:
+        if not _tracing_calls:
+            _tracing_owned = not tracemalloc.is_tracing()
+            if _tracing_owned:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        # the peak can only be reset when no other call relies on it
+        overlapping = bool(_tracing_calls)
+        for other in _tracing_calls:
+            _tracing_calls[other] = True
+        _tracing_calls[call] = overlapping
+    return call
+
+
+def _stop_tracing(call: object):
+    import tracemalloc
+
+    with _tracing_lock:
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        shared = _tracing_calls.pop(call)
+        if not _tracing_calls and _tracing_owned:
+            tracemalloc.stop()
+    return peak, snapshot, shared
+
+
+def _profile(func, args: tuple, kwargs: dict, settings: ProfileSettings):
+    import tracemalloc
+
+    name = getattr(func, "__qualname__", func.__name__)
+    stem = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{name}-{os.getpid()}"
+    profiler = None
+    if settings.cpu:
+        import cProfile
+
+        profiler = cProfile.Profile()
+
+    call = _start_tracing()
+    start = perf_counter()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+    finally:
+        seconds = perf_counter() - start
+        peak, snapshot, peak_shared = _stop_tracing(call)
+        snapshot = snapshot.filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ]
+        )
+        report = {
+            "function": name,
+            "seconds": seconds,
+            "peak_mb": peak / 1024**2,
+            "peak_shared": peak_shared,
+            "top_allocations": [
+                {
+                    "site": str(stat.traceback),
+                    "size_mb": stat.size / 1024**2,
+                    "count": stat.count,
+                }
+                for stat in snapshot.statistics("lineno")[: settings.top]
+            ],
+            "cprofile": None,
+        }
+        try:
+            settings.output_dir.mkdir(parents=True, exist_ok=True)
+            if profiler is not None:
+                report["cprofile"] = str(settings.output_dir / f"{stem}.prof")
+                profiler.dump_stats(report["cprofile"])
+            (settings.output_dir / f"{stem}.json").write_text(
+                json.dumps(report, indent=2)
+            )
+        except OSError as e:
+            log.error(f"PROFILE EXCEPTION: {str(e)}")
+        log.info(
+            f"Profiled {name}: {seconds:.1f} s, peak {report['peak_mb']:.1f} MB, "
+            f"report {settings.output_dir / stem}.json"
+        )
@@ -0,0 +1,149 @@
+"""Routing of reads to MySQL read replicas.
+
+A ``DB`` built from ``DBParams`` with ``replicas`` sends the reads of ``get``,
+``get_by_ids`` and ``size`` to one of the replicas, round robin, and everything else
+to the primary. A replica is skipped while it is unreachable, while replication is
+stopped or while it lags more than ``max_lag`` seconds behind the primary; it is
+checked again after ``check_interval`` seconds. Reads go to the primary when no
+replica is usable.
+
+One read at a time checks a stale replica, concurrent reads keep using its last
+known state meanwhile, or skip it while it was never checked.
+
+Reads that must see the caller's own writes use ``DB.primary_reads()`` or
+``get(..., use_primary=True)``.
+
+Replicas are listed in the connection config, every key left out is taken from the
+primary:
+
+.. code-block:: yaml
+
+    prod:
+      host: db-primary
+      port: 3306
+      login: user
+      password: pass
+      schema: dwh
+      replicas:
+        - host: db-replica-1
+        - host: db-replica-2
+          port: 3307
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from time import monotonic
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+# no log by default unless log system gets configured in the main code
+log.addHandler(logging.NullHandler())
+
+
+class Replica:
+    def __init__(self, name: str, engine: Engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.lag = None
+        self.checked_at = None
+        # held by the caller checking the replica
+        self.checking = threading.Lock()
+
+
+class ReplicaPool:
+    """Round robin over the healthy replicas of one primary.
+
+    Args:
+        replicas (list): ``(name, engine)`` of every replica
+        max_lag (float): seconds of replication lag above which a replica is
+            skipped
+        check_interval (float): seconds a health check result is trusted
+    """
+
+    def __init__(
+        self,
+        replicas: List[tuple],
+        max_lag: float = 30.0,
+        check_interval: float = 10.0,
+    ):
+        self.replicas = [Replica(name, engine) for name, engine in replicas]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def replication_lag(self, engine: Engine) -> Optional[float]:
+        """Seconds the replica is behind, None when replication isn't running"""
+        with engine.connect() as conn:
+            try:
+                row = conn.execute("SHOW REPLICA STATUS").fetchone()
+            except Exception:
+                # MySQL before 8.0.22 and MariaDB
+                row = conn.execute("SHOW SLAVE STATUS").fetchone()
+        if row is None:
+            return None
+        row = dict(row)
+        lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+        return None if lag is None else float(lag)
+
+    def check(self, replica: Replica):
+        try:
+            replica.lag = self.replication_lag(replica.engine)
+            replica.healthy = replica.lag is not None and replica.lag <= self.max_lag
+            if not replica.healthy:
+                log.warning(
+                    f"Replica {replica.name} skipped, "
+                    f"replication lag {replica.lag} s"
+                )
+        except Exception as e:
+            replica.healthy = False
+            log.warning(f"Replica {replica.name} skipped: {str(e)}")
+        replica.checked_at = monotonic()
+
+    def mark_failed(self, replica: Replica, error: Exception):
+        log.warning(f"Replica {replica.name} failed, reading from primary: {error}")
+        replica.healthy = False
+        replica.checked_at = monotonic()
+
+    def choose(self) -> Optional[Replica]:
+        """Next healthy replica, None when there is none"""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if self._stale(replica) and replica.checking.acquire(blocking=False):
+                try:
+                    # another caller may have checked it while we got the lock
+                    if self._stale(replica):
+                        self.check(replica)
+                finally:
+                    replica.checking.release()
+            if replica.healthy and replica.checked_at is not None:
+                return replica
+        return None
+
+    def _stale(self, replica: Replica) -> bool:
+        checked_at = replica.checked_at
+        return checked_at is None or monotonic() - checked_at > self.check_interval
+
+    def status(self) -> List[dict]:
+        return [
+            {
+                "name": r.name,
+                "healthy": r.healthy,
+                "lag": r.lag,
+                "checked_at": r.checked_at,
+            }
+            for r in self.replicas
+        ]
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
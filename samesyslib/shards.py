@@ -1,10 +1,8 @@
+import importlib
 import logging
 import time
 
-from sqlalchemy.sql import text
-from pydantic import BaseSettings, BaseModel
-from typing import Optional
-
+from samesyslib import metrics
 from samesyslib.db import DB
 from samesyslib.db_config import DBParams
 from samesyslib.utils import get_config_value
@@ -50,21 +48,45 @@ data = shards_db_client.combined_query("SELECT NOW()")
 """
 
 
-class Shard(BaseModel):
-    name: str
-    host: str
-    port: int
-    login: str
-    password: str
-    schema_: str  # reserved by pydantic
-    connect_args: Optional[dict] = {}
+def __getattr__(name):
+    # the pydantic models are imported on first use, pydantic is slow to import
+    if name in ("Shard", "ShardsSettings"):
+        return getattr(importlib.import_module("samesyslib._shard_models"), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _encode_watermark(value):
+    """Text and type name a watermark is stored as in the sync state table"""
+    from datetime import date, datetime
+    from decimal import Decimal
 
-    class Config:
-        fields = {"schema_": "schema"}
+    for kind in (bool, int, float, Decimal, datetime, date):
+        if isinstance(value, kind):
+            break
+    else:
+        kind = str
+    if kind in (datetime, date):
+        return value.isoformat(), kind.__name__
+    if kind is float:
+        return repr(value), "float"
+    return str(value), kind.__name__
 
 
-class ShardsSettings(BaseSettings):
-    SHARDS: list[Shard]
+def _decode_watermark(text, kind):
+    from datetime import date, datetime
+    from decimal import Decimal
+
+    if text is None:
+        return None
+    decoders = {
+        "bool": lambda v: v == "True",
+        "int": int,
+        "float": float,
+        "Decimal": Decimal,
+        "datetime": datetime.fromisoformat,
+        "date": date.fromisoformat,
+    }
+    return decoders.get(kind, str)(text)
 
 
 class ShardsDBClient:
@@ -79,10 +101,24 @@ class ShardsDBClient:
             it._shard = shard.name
             self._conns[shard.dict()["name"]] = DB(it)
 
+    @classmethod
+    def from_conns(cls, conns):
+        """Client over existing ``{shard name: DB}`` connections"""
+        client = cls.__new__(cls)
+        client._conns = dict(conns)
+        return client
+
     def query(self, sql):
+        from sqlalchemy.sql import text
+
         result = {}
         for name, conn in self._conns.items():
-            result[name] = conn.execute(text(sql)).fetchall()
+            with metrics.operation("shards.query", shard=name) as op:
+                with op.phase("execute"):
+                    rows = conn.execute(text(sql))
+                with op.phase("fetch"):
+                    result[name] = rows.fetchall()
+                op.rows = len(result[name])
         return result
 
     def combined_query(self, sql):
@@ -96,9 +132,160 @@ class ShardsDBClient:
 
     def combined_get_and_replace(self, sql, conn, table):
         for name, db in self._conns.items():
-            result_df = db.get(sql)
-            result_df["_shard"] = name
-            conn.send_replace(result_df, table=table)
+            with metrics.operation("shards.get_and_replace", shard=name) as op:
+                with op.phase("get"):
+                    result_df = db.get(sql)
+                result_df["_shard"] = name
+                with op.phase("replace"):
+                    conn.send_replace(result_df, table=table)
+                op.rows = result_df.shape[0]
+
+    def incremental_sync(
+        self,
+        sql,
+        conn,
+        table,
+        watermark_col,
+        schema=None,
+        state_table="_shard_sync_state",
+        sync_name=None,
+        lookback=None,
+    ):
+        """Bring ``table`` up to date with the rows of ``sql`` changed since last sync
+
+        Incremental counterpart of ``combined_get_and_replace`` for append-mostly
+        sources with an ``updated_at`` or auto-increment column. Every shard only
+        returns rows with ``watermark_col`` between the high-watermark recorded in
+        ``state_table`` for that shard and the shard's current ``MAX`` of the
+        column. The rows go through a staging table and are upserted into
+        ``table``, which needs a primary or unique key. The watermark advances to
+        that ``MAX`` in the same transaction as the upsert, only once every row is
+        staged; a failed shard raises and is synced again from the old watermark.
+
+        Watermarks are stored with their Python type and bound as parameters, so
+        numbers, decimals and datetimes compare as such on the shards.
+
+        Rows equal to the watermark are fetched again, rows committed later with
+        the same ``updated_at`` would be missed otherwise; upserting them twice is
+        harmless. A row stamped below the watermark but committed after the sync
+        read it, e.g. by a long transaction on the shard, is skipped for good
+        unless ``lookback`` covers it: every sync then starts ``lookback`` below
+        the watermark, a ``timedelta`` for temporal columns or a number for
+        numeric ones, and fetches the rows in between again.
+
+        Returns:
+            dict: number of rows synced per shard
+
+        Examples:
+
+            .. code-block:: python
+
+                shards_db_client.incremental_sync(
+                    "SELECT id, shop_id, amount, updated_at FROM sales",
+                    conn=dwh,
+                    table="sales_all_shards",
+                    watermark_col="updated_at",
+                )
+        """
+        from sqlalchemy.sql import text
+
+        schema = schema or conn._schema
+        sync_name = sync_name or table
+        state = f"{schema}.{state_table}"
+        conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS {state} (
+                    shard VARCHAR(64) NOT NULL,
+                    source VARCHAR(255) NOT NULL,
+                    watermark VARCHAR(255) NULL,
+                    watermark_type VARCHAR(16) NULL,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (shard, source)
+                );"""
+        )
+        state_key = "WHERE shard = :shard AND source = :source"
+
+        synced = {}
+        for name, db in self._conns.items():
+            key = {"shard": name, "source": sync_name}
+            with metrics.operation("shards.incremental_sync", shard=name) as op:
+                row = conn.engine.execute(
+                    text(f"SELECT watermark, watermark_type FROM {state} {state_key}"),
+                    key,
+                ).fetchone()
+                low = None if row is None else _decode_watermark(*row)
+
+                source = f"FROM ({sql}) AS src"
+                bounds = {}
+                if low is not None:
+                    source += f" WHERE src.{watermark_col} >= :low"
+                    bounds["low"] = low if lookback is None else low - lookback
+                with op.phase("get"), db._connect() as source_conn:
+                    # the bound read first, rows committed meanwhile wait for the
+                    # next sync instead of being skipped by a watermark past them
+                    high = source_conn.execute(
+                        text(f"SELECT MAX(src.{watermark_col}) {source}"), bounds
+                    ).scalar()
+                    if high is None:
+                        synced[name] = 0
+                        continue
+                    bounds["high"] = high
+                    where = " AND" if low is not None else " WHERE"
+                    query = text(
+                        f"SELECT * {source}{where} src.{watermark_col} <= :high"
+                    ).bindparams(**bounds)
+                    result_df = db.get(query, connection=source_conn)
+                op.rows = synced[name] = result_df.shape[0]
+                if result_df.empty:
+                    continue
+                result_df["_shard"] = name
+
+                staging = f"{table}_sync_{name}"
+                with op.phase("stage"):
+                    conn.execute(f"DROP TABLE IF EXISTS {schema}.{staging};")
+                    conn.send(result_df, table=staging, schema=schema)
+                    # DB.send logs its failures, a missing or short staging
+                    # table must not be upserted and advance the watermark
+                    staged = conn.execute(
+                        f"SELECT COUNT(*) FROM {schema}.{staging}"
+                    ).scalar()
+                    if staged != result_df.shape[0]:
+                        raise RuntimeError(
+                            f"Staging {schema}.{staging} holds {staged} of "
+                            f"{result_df.shape[0]} rows from {name}"
+                        )
+                watermark, watermark_type = _encode_watermark(high)
+                with op.phase("upsert"), conn.engine.begin() as tx:
+                    tx.execute(
+                        self._upsert_statement(
+                            f"{schema}.{table}",
+                            f"{schema}.{staging}",
+                            list(result_df.columns),
+                        )
+                    )
+                    tx.execute(text(f"DELETE FROM {state} {state_key}"), key)
+                    tx.execute(
+                        text(
+                            f"INSERT INTO {state} (shard, source, watermark, "
+                            f"watermark_type) VALUES (:shard, :source, :watermark, "
+                            f":watermark_type)"
+                        ),
+                        dict(key, watermark=watermark, watermark_type=watermark_type),
+                    )
+                conn.execute(f"DROP TABLE IF EXISTS {schema}.{staging};")
+                logger.info(
+                    f"Synced {synced[name]} rows of {sync_name} from {name}, "
+                    f"watermark {watermark}"
+                )
+        return synced
+
+    @staticmethod
+    def _upsert_statement(target, staging, columns):
+        names = ", ".join(f"`{col}`" for col in columns)
+        updates = ", ".join(f"`{col}` = VALUES(`{col}`)" for col in columns)
+        return (
+            f"INSERT INTO {target} ({names}) SELECT {names} FROM {staging} "
+            f"ON DUPLICATE KEY UPDATE {updates};"
+        )
 
     def get_shards_conns(self):
         return [db for name, db in self._conns.items()]
@@ -109,6 +296,8 @@ def get_shards_db_client():
     for name, value in get_config_value("db")["shards"].items():
         shards.append(value | {"name": name})
 
+    from samesyslib._shard_models import ShardsSettings
+
     shards_db_client = ShardsDBClient(ShardsSettings(SHARDS=shards))
 
     return shards_db_client
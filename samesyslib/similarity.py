@@ -0,0 +1,236 @@
+"""Shop similarity matrices keyed by shop_id.
+
+``utils.estimate_similarity`` returns a dense float64 matrix, and subsetting it
+with ``filter_rows_and_cols`` copies a block and re-parses the column labels on
+every lookup. A ``SimilarityStore`` keeps the matrix as float32, either the packed
+upper triangle of a symmetric matrix or the ``top_k`` most similar shops of every
+shop. It maps shop ids to positions once, so single pairs are read in constant time
+and blocks with one fancy indexing operation.
+
+Stores are saved as a directory of ``.npy`` files, ``load`` memory-maps them so
+processes working on the same matrix share the page cache instead of a copy each.
+
+Examples:
+
+    .. code-block:: python
+
+        store = SimilarityStore.from_frame(features, fill_na=True)
+        store.save("/data/similarity/2024-06")
+
+        store = SimilarityStore.load("/data/similarity/2024-06")
+        store.similarity(1012, 2077)
+        store.submatrix(shop_ids)  # what filter_rows_and_cols(sim_df, shop_ids) gave
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Union
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+META_FILE = "meta.json"
+# rows of the dense matrix ranked at once when building a top-k store
+TOP_K_BLOCK_ROWS = 1024
+
+
+def _triangle_offsets(n: int) -> np.ndarray:
+    """Start of every row in the packed upper triangle, diagonal included"""
+    import numpy as np
+
+    rows = np.arange(n + 1, dtype=np.int64)
+    return rows * (2 * n - rows + 1) // 2
+
+
+class SimilarityStore:
+    """Float32 similarity matrix with constant time lookups by shop id.
+
+    Build one with ``from_matrix`` or ``from_frame``, or open a saved one with
+    ``load``. Pairs left out of a top-k store read as NaN.
+
+    Args:
+        ids (array): shop ids, in matrix order
+        values (array): packed upper triangle, for triangle stores
+        neighbors (array): positions of the ``k`` most similar shops per shop,
+            for top-k stores
+        scores (array): similarities of ``neighbors``
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        values: np.ndarray = None,
+        neighbors: np.ndarray = None,
+        scores: np.ndarray = None,
+    ):
+        import pandas as pd
+
+        self.ids = ids
+        self.kind = "triangle" if values is not None else "top_k"
+        self._values = values
+        self._neighbors = neighbors
+        self._scores = scores
+        self._index = pd.Index(ids)
+        self._positions = {shop_id: i for i, shop_id in enumerate(ids.tolist())}
+        self._offsets = _triangle_offsets(len(ids))
+
+    @classmethod
+    def from_matrix(
+        cls,
+        sim: Union[np.ndarray, pd.DataFrame],
+        ids: Iterable = None,
+        top_k: int = None,
+    ) -> SimilarityStore:
+        """Store of a square similarity matrix, ids from the frame index by default.
+
+        Without ``top_k`` the matrix must be symmetric, only its upper triangle is
+        kept.
+        """
+        import numpy as np
+        import pandas as pd
+
+        if isinstance(sim, pd.DataFrame):
+            ids = sim.index if ids is None else ids
+            sim = sim.to_numpy()
+        ids = np.asarray(ids)
+        if ids.dtype == object:
+            ids = ids.astype(str)
+        n = len(ids)
+        assert sim.shape == (n, n), "similarity matrix and ids don't match"
+
+        if top_k is None:
+            offsets = _triangle_offsets(n)
+            values = np.empty(offsets[-1], dtype=np.float32)
+            for i in range(n):
+                values[offsets[i] : offsets[i + 1]] = sim[i, i:]
+            return cls(ids, values=values)
+
+        k = min(top_k, n)
+        neighbors = np.empty((n, k), dtype=np.int32)
+        scores = np.empty((n, k), dtype=np.float32)
+        for start in range(0, n, TOP_K_BLOCK_ROWS):
+            block = np.nan_to_num(
+                np.asarray(sim[start : start + TOP_K_BLOCK_ROWS], dtype=np.float32),
+                nan=-np.inf,
+            )
+            top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            neighbors[start : start + len(block)] = np.take_along_axis(top, order, 1)
+            scores[start : start + len(block)] = np.take_along_axis(
+                top_scores, order, 1
+            )
+        scores[np.isneginf(scores)] = np.nan
+        return cls(ids, neighbors=neighbors, scores=scores)
+
+    @classmethod
+    def from_frame(
+        cls, df: pd.DataFrame, fill_na: bool = False, top_k: int = None
+    ) -> SimilarityStore:
+        """Store of ``utils.estimate_similarity(df, fill_na)``"""
+        from samesyslib.utils import estimate_similarity
+
+        sim, shop_index = estimate_similarity(df, fill_na=fill_na)
+        return cls.from_matrix(sim, shop_index, top_k=top_k)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, shop_id) -> bool:
+        return shop_id in self._positions
+
+    def __repr__(self) -> str:
+        return f"SimilarityStore({len(self)} shops, {self.kind})"
+
+    def positions(self, ids: Iterable) -> np.ndarray:
+        """Matrix positions of ``ids``, -1 for ids not in the store"""
+        import numpy as np
+
+        return self._index.get_indexer(np.asarray(list(ids)))
+
+    def similarity(self, a, b) -> float:
+        """Similarity of shops ``a`` and ``b``"""
+        import numpy as np
+
+        i, j = self._positions[a], self._positions[b]
+        if self.kind == "triangle":
+            i, j = min(i, j), max(i, j)
+            return float(self._values[self._offsets[i] + j - i])
+        for row, other in ((i, j), (j, i)):
+            hit = np.flatnonzero(self._neighbors[row] == other)
+            if len(hit):
+                return float(self._scores[row, hit[0]])
+        return float("nan")
+
+    def submatrix(self, rows: Iterable, columns: Iterable = None) -> pd.DataFrame:
+        """Similarities of ``rows`` to ``columns`` as a frame indexed by shop id.
+
+        ``columns`` defaults to ``rows``, ids not in the store are left out.
+        """
+        import numpy as np
+        import pandas as pd
+
+        r = self.positions(rows)
+        r = r[r >= 0]
+        c = r if columns is None else self.positions(columns)
+        c = c[c >= 0]
+
+        if self.kind == "triangle":
+            low = np.minimum.outer(r, c)
+            high = np.maximum.outer(r, c)
+            block = np.asarray(self._values[self._offsets[low] + high - low])
+        else:
+            block = self._top_k_block(r, c)
+            block = np.where(np.isnan(block), self._top_k_block(c, r).T, block)
+        return pd.DataFrame(block, index=self.ids[r], columns=self.ids[c])
+
+    def _top_k_block(self, r: np.ndarray, c: np.ndarray) -> np.ndarray:
+        """Similarities stored in the rows ``r`` for the columns ``c``"""
+        import numpy as np
+
+        column_of = np.full(len(self), -1, dtype=np.int64)
+        column_of[c] = np.arange(len(c))
+        block = np.full((len(r), len(c)), np.nan, dtype=np.float32)
+        found = column_of[self._neighbors[r]]
+        hit_rows, hit_slots = np.nonzero(found >= 0)
+        block[hit_rows, found[hit_rows, hit_slots]] = self._scores[r][
+            hit_rows, hit_slots
+        ]
+        return block
+
+    def save(self, directory: Union[str, Path]):
+        """Write the store as ``.npy`` files in ``directory``"""
+        import numpy as np
+
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / "ids.npy", self.ids)
+        arrays = {
+            "values": self._values,
+            "neighbors": self._neighbors,
+            "scores": self._scores,
+        }
+        for name, array in arrays.items():
+            if array is not None:
+                np.save(directory / f"{name}.npy", array)
+        (directory / META_FILE).write_text(json.dumps({"kind": self.kind}))
+
+    @classmethod
+    def load(cls, directory: Union[str, Path], mmap: bool = True) -> SimilarityStore:
+        """Open a saved store, memory-mapped read-only unless ``mmap`` is False"""
+        import numpy as np
+
+        directory = Path(directory)
+        mmap_mode = "r" if mmap else None
+        kind = json.loads((directory / META_FILE).read_text())["kind"]
+        ids = np.load(directory / "ids.npy")
+        if kind == "triangle":
+            return cls(ids, values=np.load(directory / "values.npy", mmap_mode))
+        return cls(
+            ids,
+            neighbors=np.load(directory / "neighbors.npy", mmap_mode),
+            scores=np.load(directory / "scores.npy", mmap_mode),
+        )
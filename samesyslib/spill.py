@@ -0,0 +1,366 @@
+"""Column files on disk for query results larger than memory.
+
+``DB.get(query, spill_threshold_mb=...)`` streams the result in chunks and, once the
+buffered chunks cross the threshold, appends every further chunk to one set of
+files per column and returns a ``SpilledFrame`` instead of a ``pd.DataFrame``.
+
+Numeric, boolean and datetime columns are raw fixed width arrays read back as
+``np.memmap``, so NumPy and pandas page them in on demand. String columns are
+stored as UTF-8 bytes plus end offsets and decoded only for the rows asked for.
+Integer and boolean columns keep a null mask, they come back as float64 with NaN
+where NULLs were. ``DATE`` columns come back as datetime64.
+
+The storage of a column is decided from the first chunk holding a value in it and
+widened when a later chunk doesn't fit: integers to wider integers or float64,
+and mixed numbers, dates and strings to strings. A widened column is rewritten
+from its files once, so the frame ends up as if its type had been known upfront.
+
+Examples:
+
+    .. code-block:: python
+
+        with db.get("SELECT * FROM events", spill_threshold_mb=4096) as events:
+            amounts = events.values("amount")  # np.memmap, nothing read yet
+            total = amounts.sum()
+            for chunk in events.iter_chunks(1_000_000):
+                process(chunk)
+"""
+
+from __future__ import annotations
+
+import json
+import shutil
+import tempfile
+import weakref
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, List, Union
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+SCHEMA_FILE = "schema.json"
+
+
+def _column_kind(col: pd.Series) -> tuple:
+    """Storage kind and dtype of the values of one chunk of a column."""
+    from pandas.api.types import infer_dtype
+
+    kind = col.dtype.kind
+    if kind in "iu":
+        return "masked", str(col.dtype)
+    if kind == "b":
+        return "masked", "bool"
+    if kind == "f":
+        return "fixed", str(col.dtype)
+    if kind == "M" and getattr(col.dtype, "tz", None) is None:
+        return "fixed", "datetime64[ns]"
+    inferred = infer_dtype(col, skipna=True)
+    if inferred in ("date", "datetime", "datetime64"):
+        return "fixed", "datetime64[ns]"
+    if inferred == "decimal":
+        return "fixed", "float64"
+    if inferred == "bytes":
+        return "binary", "object"
+    return "string", "object"
+
+
+def _is_number(kind: str, dtype: str) -> bool:
+    return kind in ("fixed", "masked") and not dtype.startswith("datetime64")
+
+
+def _widen(current: tuple, col: pd.Series) -> tuple:
+    """Storage kind holding both the values spilled as ``current`` and ``col``."""
+    import numpy as np
+
+    new = _column_kind(col)
+    if new == current:
+        return current
+    if not (_is_number(*current) and _is_number(*new)):
+        return "string", "object"
+    if current[0] == "masked" and new[0] == "fixed":
+        # integers with NULLs arrive as floats, keep them integers when they are
+        values = col.dropna()
+        limits = np.iinfo(current[1]) if current[1] != "bool" else None
+        if (
+            limits is not None
+            and (values % 1 == 0).all()
+            and values.min() >= limits.min
+            and values.max() <= limits.max
+        ):
+            return current
+    dtype = np.promote_types(current[1], new[1])
+    if current[0] == new[0] == "masked" and dtype.kind in "iub":
+        return "masked", str(dtype)
+    return "fixed", str(np.promote_types(dtype, np.float32))
+
+
+def _encode_string(value) -> bytes:
+    return (value if isinstance(value, str) else str(value)).encode("utf-8")
+
+
+class SpillWriter:
+    """Appends frames of one query result to per column files in ``directory``."""
+
+    def __init__(self, directory: Union[str, Path] = None):
+        self.directory = Path(
+            tempfile.mkdtemp(prefix="samesyslib-spill-", dir=directory)
+        )
+        self.schema = None
+        self.rows = 0
+        self._files = []
+        self._offsets = []
+        self._has_values = []
+
+    def _open(self, df: pd.DataFrame):
+        self.schema = []
+        for position, (name, col) in enumerate(df.items()):
+            kind, dtype = _column_kind(col)
+            self.schema.append({"name": name, "kind": kind, "dtype": dtype})
+            self._files.append(None)
+            self._offsets.append(0)
+            self._has_values.append(False)
+            self._open_column(position)
+
+    def _open_column(self, position: int):
+        kind = self.schema[position]["kind"]
+        stem = self.directory / f"c{position}"
+        files = {"values": open(f"{stem}.values", "wb")}
+        if kind != "fixed":
+            files["mask"] = open(f"{stem}.mask", "wb")
+        if kind in ("string", "binary"):
+            files["offsets"] = open(f"{stem}.offsets", "wb")
+        self._files[position] = files
+        self._offsets[position] = 0
+
+    def _retype(self, position: int, kind: str, dtype: str) -> int:
+        """Rewrite the values spilled so far in a column with a wider kind."""
+        import numpy as np
+        import pandas as pd
+
+        column = self.schema[position]
+        for f in self._files[position].values():
+            f.close()
+        (self.directory / SCHEMA_FILE).write_text(
+            json.dumps({"rows": self.rows, "columns": self.schema})
+        )
+        spilled = SpilledFrame(self.directory)
+        if column["kind"] == "masked":
+            # as objects, integers read back through float64 would lose precision
+            values = np.array(spilled.values(column["name"])).astype(object)
+            values[np.array(spilled.mask(column["name"]))] = None
+            spilled_values = pd.Series(values, dtype=object)
+        else:
+            spilled_values = spilled.column(column["name"])
+        del spilled
+        for part in self._files[position]:
+            (self.directory / f"c{position}.{part}").unlink()
+
+        column.update(kind=kind, dtype=dtype)
+        self._open_column(position)
+        return self._write(position, spilled_values)
+
+    def append(self, df: pd.DataFrame) -> int:
+        """Write a chunk, returns the number of bytes written."""
+        if self.schema is None:
+            self._open(df)
+        written = 0
+        for position, (_, col) in enumerate(df.items()):
+            if not col.isna().all():
+                column = self.schema[position]
+                current = column["kind"], column["dtype"]
+                if self._has_values[position]:
+                    kind = _widen(current, col)
+                else:
+                    kind = _column_kind(col)
+                if kind != current:
+                    written += self._retype(position, *kind)
+                self._has_values[position] = True
+            written += self._write(position, col)
+        self.rows += df.shape[0]
+        return written
+
+    def _write(self, position: int, col: pd.Series) -> int:
+        import numpy as np
+        import pandas as pd
+
+        files = self._files[position]
+        kind, dtype = self.schema[position]["kind"], self.schema[position]["dtype"]
+        written = 0
+        missing = col.isna().to_numpy()
+        if kind == "fixed":
+            if dtype.startswith("datetime64"):
+                col = pd.to_datetime(col)
+            values = col.to_numpy(dtype=dtype).tobytes()
+        elif kind == "masked":
+            values = col.where(~missing, 0).to_numpy(dtype=dtype).tobytes()
+        else:
+            encode = _encode_string if kind == "string" else bytes
+            encoded = [b"" if m else encode(v) for v, m in zip(col, missing)]
+            ends = np.cumsum(np.fromiter(map(len, encoded), np.int64, len(encoded)))
+            ends += self._offsets[position]
+            if len(ends):
+                self._offsets[position] = int(ends[-1])
+            values = b"".join(encoded)
+            files["offsets"].write(ends.tobytes())
+            written += ends.nbytes
+        files["values"].write(values)
+        written += len(values)
+        if "mask" in files:
+            files["mask"].write(missing.astype(np.uint8).tobytes())
+            written += len(missing)
+        return written
+
+    def finish(self) -> SpilledFrame:
+        for files in self._files:
+            for f in files.values():
+                f.close()
+        (self.directory / SCHEMA_FILE).write_text(
+            json.dumps({"rows": self.rows, "columns": self.schema})
+        )
+        return SpilledFrame(self.directory, owner=True)
+
+    def abort(self):
+        for files in self._files:
+            for f in files.values():
+                f.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class SpilledFrame:
+    """Read-only, frame-like view of column files written by ``SpillWriter``.
+
+    Args:
+        directory (str, Path): directory holding the column files
+        owner (bool): delete the directory on ``close`` or garbage collection;
+            frames opened from another process should leave it to the writer
+    """
+
+    def __init__(self, directory: Union[str, Path], owner: bool = False):
+        self.directory = Path(directory)
+        meta = json.loads((self.directory / SCHEMA_FILE).read_text())
+        self._rows = meta["rows"]
+        self._schema = {
+            c["name"]: (i, c["kind"], c["dtype"]) for i, c in enumerate(meta["columns"])
+        }
+        self._columns = [c["name"] for c in meta["columns"]]
+        self._finalizer = None
+        if owner:
+            self._finalizer = weakref.finalize(
+                self, shutil.rmtree, str(self.directory), ignore_errors=True
+            )
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    @property
+    def shape(self) -> tuple:
+        return self._rows, len(self._columns)
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __repr__(self) -> str:
+        rows, cols = self.shape
+        return f"SpilledFrame({rows} rows x {cols} columns, {self.directory})"
+
+    def _memmap(self, position: int, part: str, dtype) -> np.ndarray:
+        import numpy as np
+
+        path = self.directory / f"c{position}.{part}"
+        if path.stat().st_size == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def values(self, name: str) -> np.ndarray:
+        """Memory-mapped values of a numeric, boolean or datetime column.
+
+        NULLs of integer and boolean columns are stored as 0, see ``mask``.
+        """
+        position, kind, dtype = self._schema[name]
+        if kind not in ("fixed", "masked"):
+            raise TypeError(f"Column {name} holds strings, use frame[{name!r}]")
+        return self._memmap(position, "values", dtype)
+
+    def mask(self, name: str) -> np.ndarray:
+        """Boolean array, True where the column is NULL."""
+        import numpy as np
+
+        position, kind, dtype = self._schema[name]
+        if kind == "fixed" and dtype.startswith("datetime64"):
+            return np.isnat(self.values(name))
+        if kind == "fixed":
+            return np.isnan(self.values(name))
+        return self._memmap(position, "mask", np.bool_)
+
+    def column(self, name: str, start: int = 0, stop: int = None) -> pd.Series:
+        """Rows ``start:stop`` of a column as a series, only those rows are read."""
+        import numpy as np
+        import pandas as pd
+
+        stop = self._rows if stop is None else min(stop, self._rows)
+        position, kind, dtype = self._schema[name]
+        index = pd.RangeIndex(start, max(start, stop))
+        if kind == "fixed":
+            return pd.Series(
+                self.values(name)[start:stop], index=index, name=name, copy=False
+            )
+        mask = self._memmap(position, "mask", np.bool_)[start:stop]
+        if kind == "masked":
+            values = self.values(name)[start:stop]
+            if mask.any():
+                values = np.where(mask, np.nan, values)
+            return pd.Series(values, index=index, name=name, copy=False)
+
+        offsets = self._memmap(position, "offsets", np.int64)
+        ends = offsets[start:stop]
+        if not len(ends):
+            return pd.Series([], index=index, name=name, dtype=object)
+        first = int(offsets[start - 1]) if start else 0
+        raw = bytes(self._memmap(position, "values", np.uint8)[first : int(ends[-1])])
+        bounds = np.concatenate(([0], ends - first)).tolist()
+        if kind == "string":
+            values = [raw[a:b].decode("utf-8") for a, b in zip(bounds[:-1], bounds[1:])]
+        else:
+            values = [raw[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+        result = pd.Series(values, index=index, name=name, dtype=object)
+        if mask.any():
+            result[mask] = None
+        return result
+
+    def __getitem__(self, key: Union[str, List[str]]) -> Union[pd.Series, pd.DataFrame]:
+        if isinstance(key, str):
+            return self.column(key)
+        return self.slice(0, self._rows, columns=key)
+
+    def slice(self, start: int, stop: int, columns: List[str] = None) -> pd.DataFrame:
+        import pandas as pd
+
+        columns = self._columns if columns is None else columns
+        return pd.concat([self.column(name, start, stop) for name in columns], axis=1)
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        return self.slice(0, n)
+
+    def iter_chunks(
+        self, rows: int = 1000000, columns: List[str] = None
+    ) -> Iterator[pd.DataFrame]:
+        """Yield the frame ``rows`` rows at a time."""
+        for start in range(0, self._rows, rows):
+            yield self.slice(start, start + rows, columns)
+
+    def to_pandas(self) -> pd.DataFrame:
+        """Materialize the whole frame in memory."""
+        return self.slice(0, self._rows)
+
+    def close(self):
+        """Delete the column files if this frame owns them."""
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
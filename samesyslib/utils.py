@@ -1,19 +1,29 @@
+from __future__ import annotations
+
 # Standard library imports
 import bz2
 import io
 import json
 import os
 import pickle
-from typing import Dict, Union, List
+import re
+import string
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Union, List
 from subprocess import check_output, STDOUT
-
-# Third party imports
-import numpy as np
-import pandas as pd
 from pathlib import Path
 
+from samesyslib.buffering import BufferedWriter
+
+# Third party imports, deferred to the functions using them to keep import time low
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
 ConfigType = Dict[str, Dict[str, Union[str, int]]]
 
+# translation table removing ASCII punctuation, built once for remove_special_char
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
 
 def load_config(config_path: Union[str, Path]) -> ConfigType:
     """Safely load yaml type configurations
@@ -69,12 +79,121 @@ def list_files(dir: Union[str, Path]) -> List[str]:
     return check_output(["ls", dir]).decode("utf8").strip().split("\n")
 
 
+_DELIMITER_RE = re.compile(r"\s*DELIMITER\s+(\S+)", re.IGNORECASE)
+
+
+def iter_sql_statements(
+    script: Union[str, Iterable[str]], delimiter: str = ";"
+) -> Iterator[str]:
+    """Split an SQL script into statements, reading it line by line.
+
+    Delimiters inside quoted strings, identifiers and comments are ignored, and
+    ``DELIMITER`` directives (as used around procedure bodies) switch the statement
+    terminator the same way the mysql client does. Comments are kept within the
+    statement that follows them, statements holding nothing but comments are dropped.
+
+    Args:
+        script (str, Iterable[str]): script text or an iterable of its lines, e.g.
+            an open file
+        delimiter (str): statement terminator at the start of the script
+
+    Yields:
+        str: statements stripped of surrounding whitespace and of the terminator
+
+    Examples:
+
+        .. code-block:: python
+
+            with open("etl.sql") as reader:
+                for statement in iter_sql_statements(reader):
+                    conn.execute(statement)
+    """
+    if isinstance(script, str):
+        script = script.splitlines(keepends=True)
+
+    def tokens(delimiter):
+        return re.compile(r"['\"`#]|--|/\*|" + re.escape(delimiter))
+
+    special = tokens(delimiter)
+    buf = []
+    has_code = False
+    quote = None
+    in_comment = False
+    for line in script:
+        if quote is None and not in_comment and not has_code:
+            match = _DELIMITER_RE.match(line)
+            if match:
+                delimiter = match.group(1)
+                special = tokens(delimiter)
+                buf = []
+                continue
+        i, n = 0, len(line)
+        while i < n:
+            if in_comment:
+                end = line.find("*/", i)
+                if end == -1:
+                    buf.append(line[i:])
+                    break
+                buf.append(line[i : end + 2])
+                i = end + 2
+                in_comment = False
+                continue
+            if quote is not None:
+                j = i
+                while j < n:
+                    if line[j] == "\\" and quote != "`":
+                        j += 2
+                    elif line[j] == quote and line[j + 1 : j + 2] == quote:
+                        j += 2
+                    elif line[j] == quote:
+                        break
+                    else:
+                        j += 1
+                if j >= n:
+                    buf.append(line[i:])
+                    break
+                buf.append(line[i : j + 1])
+                i = j + 1
+                quote = None
+                continue
+
+            match = special.search(line, i)
+            if match is None:
+                chunk = line[i:]
+                has_code = has_code or bool(chunk.strip())
+                buf.append(chunk)
+                break
+            start, token = match.start(), match.group()
+            chunk = line[i:start]
+            has_code = has_code or bool(chunk.strip())
+            buf.append(chunk)
+            i = match.end()
+            if token == delimiter:
+                if has_code:
+                    yield "".join(buf).strip()
+                buf = []
+                has_code = False
+            elif token in ("'", '"', "`"):
+                quote = token
+                has_code = True
+                buf.append(token)
+            elif token == "/*":
+                in_comment = True
+                buf.append(token)
+            elif token == "--" and line[i : i + 1] not in ("", " ", "\t", "\n", "\r"):
+                # "--" only starts a comment when followed by whitespace
+                has_code = True
+                buf.append(token)
+            else:
+                buf.append(line[start:])
+                break
+    if has_code:
+        yield "".join(buf).strip()
+
+
 def sql_from_file(filename: Union[str, Path]) -> List[str]:
     with open(filename, "r") as reader:
-        sql_file = reader.read()  # reads as string
-    # all SQL commands (split on ';')
-    sql_commands = sql_file.split(";")
-    return sql_commands
+        return list(iter_sql_statements(reader))
 
 
 def get_col_types(df, columns=None):
@@ -85,62 +204,144 @@ def get_col_types(df, columns=None):
         print(f"{col}: {type(value)}: {value}")
 
 
-def dataset_summary(data, index_summary=True, detail=False, quick=True):
+def _summary_columns(data, index_summary):
+    """Yield ``(name, series)`` pairs of a frame without copying it.
+
+    Index levels come first and are named the same way ``reset_index`` names them.
+    """
     import pandas as pd
 
     if index_summary:
-        df = data.copy()
-        df = df.reset_index()
+        names = data.index.names
+        for level, name in enumerate(names):
+            if name is None:
+                if len(names) == 1 and "index" not in data.columns:
+                    name = "index"
+                else:
+                    name = f"level_{level}"
+            yield name, pd.Series(data.index.get_level_values(level), name=name)
+    for position, name in enumerate(data.columns):
+        yield name, data.iloc[:, position]
+
+
+def _estimate_distinct(sample, population: int) -> int:
+    """Estimate distinct values among ``population`` non-null values from a uniform
+    ``sample`` of them with the bias-corrected Chao1 estimator.
+    """
+    n = sample.shape[0]
+    if n == 0 or population <= n:
+        return int(sample.nunique())
+    frequencies = sample.value_counts().value_counts()
+    distinct = int(frequencies.sum())
+    singletons = int(frequencies.get(1, 0))
+    doubletons = int(frequencies.get(2, 0))
+    estimate = distinct + singletons * (singletons - 1) / (2 * (doubletons + 1))
+    return int(min(round(estimate), population))
+
+
+def _column_summary(col, detail, quick, scale=None, population=None):
+    """All statistics of one column, computed in a single visit of the column."""
+    from pandas.api.types import is_numeric_dtype
+
+    n_rows = col.shape[0]
+    missing = col.isna()
+    n_miss = int(missing.sum())
+    valid = col[~missing] if n_miss else col
+
+    stats = {"type": col.dtype}
+    if detail:
+        stats["first"] = col.iloc[0] if n_rows else None
+        stats["last"] = col.iloc[-1] if n_rows else None
+        try:
+            stats["min"] = valid.min() if valid.shape[0] else float("nan")
+            stats["max"] = valid.max() if valid.shape[0] else float("nan")
+        except TypeError:
+            stats["min"] = stats["max"] = float("nan")
+    if not quick:
+        numeric = is_numeric_dtype(col.dtype)
+        stats["mean"] = float(valid.mean()) if numeric else float("nan")
+        stats["std"] = float(valid.std()) if numeric else float("nan")
+
+    if scale is None:
+        stats["n_uniq"] = int(valid.nunique())
+    else:
+        n_miss = int(round(n_miss * scale))
+        stats["n_uniq"] = _estimate_distinct(valid, population - n_miss)
+    stats["n_miss"] = n_miss
+    stats["obs"] = (n_rows if scale is None else population) - n_miss
+    return stats
+
+
+def dataset_summary(
+    data,
+    index_summary=True,
+    detail=False,
+    quick=True,
+    n_jobs: int = 1,
+    sample: Union[int, float] = None,
+    random_state: int = None,
+):
+    """Per column summary of a dataframe: dtype, distinct, missing and observed counts.
+
+    Every statistic of a column is computed in the same visit of that column and
+    the frame is never copied, index levels are summarised in place.
+
+    Args:
+        data (pd.DataFrame): frame to summarise
+        index_summary (bool): include index levels as leading rows
+        detail (bool): add ``first``, ``last``, ``min`` and ``max`` columns
+        quick (bool): skip ``mean`` and ``std``
+        n_jobs (int): number of threads summarising columns in parallel
+        sample (int, float): summarise a random sample of that many rows (or that
+            fraction of rows); counts are scaled to the full frame and ``n_uniq``
+            becomes an estimate
+        random_state (int): seed used for ``sample``
+
+    Returns:
+        pd.DataFrame: one row per column
+    """
+    import pandas as pd
+
+    population = data.shape[0]
+    scale = None
+    edges = None
+    if sample is not None:
+        n = int(round(sample * population)) if isinstance(sample, float) else sample
+        if 0 < n < population:
+            # first and last rows must come from the full frame, not the sample
+            edges = pd.concat([data.head(1), data.tail(1)])
+            data = data.sample(n=n, random_state=random_state)
+            scale = population / n
+
+    columns = list(_summary_columns(data, index_summary))
+
+    def summarise(item):
+        return _column_summary(item[1], detail, quick, scale, population)
+
+    if n_jobs > 1 and len(columns) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            rows = list(executor.map(summarise, columns))
     else:
-        df = data
-    df_s = pd.DataFrame(df.dtypes, columns=["type"])
+        rows = [summarise(item) for item in columns]
+
+    if detail and edges is not None:
+        for stats, (_, col) in zip(rows, _summary_columns(edges, index_summary)):
+            stats["first"], stats["last"] = col.iloc[0], col.iloc[-1]
+
+    order = ["type"]
     if detail:
-        df_s = df_s.merge(df.head(1).T, left_index=True, right_index=True, how="outer")
-        df_s = df_s.merge(df.tail(1).T, left_index=True, right_index=True, how="outer")
-        df_s = df_s.merge(
-            pd.DataFrame(df.min(), columns=["min"]),
-            left_index=True,
-            right_index=True,
-            how="left",
-        )
-        df_s = df_s.merge(
-            pd.DataFrame(df.max(), columns=["max"]),
-            left_index=True,
-            right_index=True,
-            how="left",
-        )
-        df_s.columns = ["type", "first", "last", "min", "max"]
+        order += ["first", "last", "min", "max"]
     if not quick:
-        df_s = df_s.merge(
-            pd.DataFrame(df.mean(numeric_only=None), columns=["mean"]),
-            left_index=True,
-            right_index=True,
-            how="outer",
-        )
-        df_s = df_s.merge(
-            pd.DataFrame(df.std(), columns=["std"]),
-            left_index=True,
-            right_index=True,
-            how="outer",
-        )
-    df_s = df_s.merge(
-        pd.DataFrame(df.nunique(), columns=["n_uniq"]),
-        left_index=True,
-        right_index=True,
-        how="outer",
-    )
-    df_s = df_s.merge(
-        pd.DataFrame(df.isnull().sum(), columns=["n_miss"]),
-        left_index=True,
-        right_index=True,
-        how="outer",
-    )
-    df_s = df_s.merge(
-        pd.DataFrame(df.count(), columns=["obs"]),
-        left_index=True,
-        right_index=True,
-        how="outer",
+        order += ["mean", "std"]
+    order += ["n_uniq", "n_miss", "obs"]
+    df_s = pd.DataFrame.from_records(
+        rows, index=[name for name, _ in columns], columns=order
     )
+    for col in ["first", "last", "min", "max"]:
+        if col in df_s:
+            df_s[col] = df_s[col].astype(object).infer_objects()
     return df_s
 
 
@@ -174,6 +375,24 @@ def get_data_from_query(sql_dir, table, conn, verbose=True):
     return df
 
 
+def get_data_from_queries(
+    sql_dir, tables, conn, max_concurrency=4, verbose=True
+) -> Dict[str, pd.DataFrame]:
+    """``get_data_from_query`` for several tables, queried at the same time"""
+    import time
+
+    queries = {
+        table: sql_from_file(Path(sql_dir, f"{table}.sql"))[0] for table in tables
+    }
+    tic1 = time.perf_counter()
+    frames = conn.get_many(queries, max_concurrency=max_concurrency)
+    toc1 = time.perf_counter()
+    if verbose > 0:
+        shapes = ", ".join(f"[{table}]: {df.shape}" for table, df in frames.items())
+        print(f"Downloaded {shapes} in {toc1 - tic1:0.4f} seconds")
+    return frames
+
+
 def get_git_info(repo_dir: str) -> dict:
     """
     Extract basic git info from CWD
@@ -238,7 +457,182 @@ def update_model_metadata(
     )
 
 
+def _sql_value(value: object) -> object:
+    """Python value a DBAPI driver can bind: numpy scalars unwrapped, NaN as NULL,
+    dicts and lists as JSON.
+    """
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if type(value).__module__ == "numpy":
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+class MetadataWriter(BufferedWriter):
+    """Buffered, thread-safe replacement of ``init_metadata`` and
+    ``update_model_metadata`` for loops writing metadata many times per run.
+
+    The table structure is read once. Inserted rows and key updates are kept in
+    memory and written as one multi-row INSERT per set of columns and one UPDATE
+    for all pending runs, when ``max_pending`` rows and runs are buffered, when
+    ``flush_interval`` seconds passed since the first buffered write, on ``flush``,
+    ``close`` or at interpreter exit. Updates of a run whose row is still buffered
+    are merged into that row.
+
+    Args:
+        conn (DB): database connection
+        table_name (str): metadata table
+        schema (str): schema of the metadata table
+        run_id_col (str): column identifying a run, needed by ``update``
+        max_pending (int): buffered rows plus updated runs triggering a flush
+        flush_interval (float): seconds after which buffered writes are flushed,
+            None to flush on size, explicit ``flush`` and exit only
+
+    Examples:
+
+        .. code-block:: python
+
+            with MetadataWriter(conn, "model_runs", "ml", run_id_col="run_id") as writer:
+                writer.insert({"run_id": run_id, "model": "xgboost"})
+                for epoch in range(100):
+                    writer.update(run_id, "last_epoch", epoch)
+    """
+
+    def __init__(
+        self,
+        conn: object,
+        table_name: str,
+        schema: str,
+        run_id_col: str = None,
+        max_pending: int = 100,
+        flush_interval: float = 5.0,
+    ):
+        super().__init__(flush_delay=flush_interval)
+        self.conn = conn
+        self.table = f"`{schema}`.`{table_name}`"
+        self.run_id_col = run_id_col
+        self.max_pending = max_pending
+        self.columns = list(
+            conn.get(
+                f"SELECT * FROM {self.table} LIMIT 0",
+                optimize_verbose=False,
+                timing_verbose=False,
+            ).columns
+        )
+        self._rows = []
+        self._updates = {}
+
+    @property
+    def flush_interval(self) -> float:
+        return self.flush_delay
+
+    def _check_columns(self, keys):
+        unknown = set(keys) - set(self.columns)
+        if unknown:
+            raise KeyError(f"Columns {sorted(unknown)} not in {self.table}")
+
+    def _full(self) -> bool:
+        return len(self._rows) + len(self._updates) >= self.max_pending
+
+    def insert(self, metadata: dict):
+        """Buffer a row, columns left out get their default."""
+        self._check_columns(metadata)
+        with self._lock:
+            self._rows.append(dict(metadata))
+            full = self._buffered()
+        if full:
+            self.flush()
+
+    def update(self, run_id: str, key: str, value: object):
+        """Buffer ``SET key = value`` for the row of ``run_id``."""
+        self.update_many(run_id, {key: value})
+
+    def update_many(self, run_id: str, values: dict):
+        assert self.run_id_col is not None, "run_id_col is needed to update"
+        self._check_columns(values)
+        with self._lock:
+            for row in self._rows:
+                if row.get(self.run_id_col) == run_id:
+                    row.update(values)
+                    return
+            self._updates.setdefault(run_id, {}).update(values)
+            full = self._buffered()
+        if full:
+            self.flush()
+
+    def _take(self):
+        if not self._rows and not self._updates:
+            return None
+        rows, self._rows = self._rows, []
+        updates, self._updates = self._updates, {}
+        return rows, updates
+
+    def _write(self, pending: tuple):
+        """Write buffered rows and updates in one transaction, inserts first."""
+        from sqlalchemy import text
+
+        rows, updates = pending
+        with self.conn.engine.begin() as tx:
+            for statement, params in self._insert_statements(rows):
+                tx.execute(text(statement), params)
+            if updates:
+                statement, params = self._update_statement(updates)
+                tx.execute(text(statement), params)
+
+    def _restore(self, pending: tuple):
+        rows, updates = pending
+        self._rows = rows + self._rows
+        for run_id, values in updates.items():
+            values.update(self._updates.get(run_id, {}))
+            self._updates[run_id] = values
+
+    def _insert_statements(self, rows: list) -> list:
+        """One multi-row INSERT per set of columns present in the rows"""
+        by_columns = {}
+        for row in rows:
+            by_columns.setdefault(tuple(row), []).append(row)
+        statements = []
+        for columns, group in by_columns.items():
+            names = ", ".join(f"`{col}`" for col in columns)
+            binds = ", ".join(f":p{i}" for i in range(len(columns)))
+            params = [
+                {f"p{i}": _sql_value(row[col]) for i, col in enumerate(columns)}
+                for row in group
+            ]
+            statements.append(
+                (f"INSERT INTO {self.table} ({names}) VALUES ({binds})", params)
+            )
+        return statements
+
+    def _update_statement(self, updates: dict) -> tuple:
+        params = {}
+        runs = []
+        for r, run_id in enumerate(updates):
+            params[f"r{r}"] = _sql_value(run_id)
+            runs.append(f":r{r}")
+        assignments = []
+        keys = sorted({key for values in updates.values() for key in values})
+        for k, key in enumerate(keys):
+            cases = []
+            for r, values in enumerate(updates.values()):
+                if key in values:
+                    params[f"v{r}_{k}"] = _sql_value(values[key])
+                    cases.append(f"WHEN :r{r} THEN :v{r}_{k}")
+            assignments.append(
+                f"`{key}` = CASE `{self.run_id_col}` {' '.join(cases)} ELSE `{key}` END"
+            )
+        statement = (
+            f"UPDATE {self.table} SET {', '.join(assignments)} "
+            f"WHERE `{self.run_id_col}` IN ({', '.join(runs)})"
+        )
+        return statement, params
+
+
 def split_array_into_batches(shop_list: object, batch_size: int):
+    import numpy as np
+
     if shop_list.shape[0] > batch_size:
         return np.array_split(
             shop_list.values, np.ceil(shop_list.shape[0] / batch_size)
@@ -247,6 +641,159 @@ def split_array_into_batches(shop_list: object, batch_size: int):
         return np.array_split(shop_list.values, 1)
 
 
+def _to_shared_memory(result: object) -> tuple:
+    """Move the numeric columns of a frame returned by a worker to shared memory.
+
+    Returns ``("frame", segment name, column layout, remaining frame)``, the other
+    columns and the index are pickled with the remaining frame. Anything but a
+    frame is returned as ``("object", result)``.
+    """
+    import numpy as np
+    import pandas as pd
+    from multiprocessing import shared_memory
+
+    if not isinstance(result, pd.DataFrame):
+        return "object", result
+    numeric = [
+        position
+        for position, dtype in enumerate(result.dtypes)
+        if isinstance(dtype, np.dtype) and dtype.kind in "biufmM"
+    ]
+    if not numeric:
+        return "object", result
+
+    layout = []
+    offset = 0
+    for position in numeric:
+        dtype = result.dtypes.iloc[position]
+        layout.append((position, dtype.str, offset))
+        offset += -(-dtype.itemsize * result.shape[0] // 8) * 8
+    segment = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    try:
+        for position, dtype, start in layout:
+            column = result.iloc[:, position].to_numpy()
+            target = np.ndarray(column.shape, dtype, buffer=segment.buf, offset=start)
+            target[:] = column
+            del target
+    except BaseException:
+        segment.close()
+        segment.unlink()
+        raise
+    segment.close()
+    rest = result.drop(columns=result.columns[numeric])
+    return "frame", segment.name, layout, result.columns, rest
+
+
+def _from_shared_memory(part: tuple) -> object:
+    """Rebuild a frame sent by ``_to_shared_memory`` and free its segment."""
+    import numpy as np
+    import pandas as pd
+    from multiprocessing import shared_memory
+
+    if part[0] == "object":
+        return part[1]
+    _, name, layout, columns, rest = part
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        values = {}
+        for position, dtype, start in layout:
+            view = np.ndarray(len(rest), dtype=dtype, buffer=segment.buf, offset=start)
+            values[position] = view.copy()
+            del view
+    finally:
+        segment.close()
+        segment.unlink()
+    rest_positions = [p for p in range(len(columns)) if p not in values]
+    for position, (_, col) in zip(rest_positions, rest.items()):
+        values[position] = col.array
+    frame = pd.DataFrame(
+        {p: values[p] for p in range(len(columns))}, index=rest.index, copy=False
+    )
+    frame.columns = columns
+    return frame
+
+
+def _release_shared_memory(part: tuple):
+    from multiprocessing import shared_memory
+
+    if part[0] == "frame":
+        segment = shared_memory.SharedMemory(name=part[1])
+        segment.close()
+        segment.unlink()
+
+
+def _run_shop_batch(func, batch) -> tuple:
+    return _to_shared_memory(func(batch))
+
+
+def process_shop_batches(
+    func,
+    shop_list: object,
+    batch_size: int = 100,
+    max_workers: int = None,
+    initializer=None,
+    initargs: tuple = (),
+    mp_context=None,
+):
+    """Run ``func(batch)`` for every batch of ``split_array_into_batches`` in a
+    process pool.
+
+    Idle workers take the next pending batch, so slow batches don't hold up the
+    rest. Numeric columns of the frames returned by ``func`` come back through
+    shared memory, only the other columns and the index are pickled. Frames are
+    concatenated in batch order whatever order the batches finish in; when
+    ``func`` returns anything else the list of results is returned.
+
+    ``func`` runs in another process, it has to be a module level function and
+    has to open its own database connection, e.g. in ``initializer``, connections
+    of the parent process can't be shared.
+
+    Examples:
+
+        .. code-block:: python
+
+            def shop_features(batch):
+                data = read_batched_shops_data(worker_conn(), batch, "ml", "daily")
+                return preprocess_activities(data)
+
+            features = process_shop_batches(shop_features, shops.shop_id, 500)
+    """
+    import pandas as pd
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from multiprocessing import resource_tracker
+
+    batches = split_array_into_batches(pd.Series(shop_list), batch_size)
+    # workers share the tracker of this process, segments they create and this
+    # process unlinks are then neither leaked nor unlinked twice
+    resource_tracker.ensure_running()
+    parts = [None] * len(batches)
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=mp_context,
+        initializer=initializer,
+        initargs=initargs,
+    ) as executor:
+        futures = {
+            executor.submit(_run_shop_batch, func, batch): i
+            for i, batch in enumerate(batches)
+        }
+        try:
+            for future in as_completed(futures):
+                parts[futures[future]] = future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            for future in futures:
+                if not future.cancelled() and future.exception() is None:
+                    _release_shared_memory(future.result())
+            raise
+
+    results = [_from_shared_memory(part) for part in parts]
+    if results and all(isinstance(r, pd.DataFrame) for r in results):
+        return pd.concat(results)
+    return results
+
+
 def save_bzipped(obj: object, filename: object, protocol: int = -1):
     """
     Save python object into pickle and compress it
@@ -270,27 +817,20 @@ def read_batched_shops_data(
     run_id_col: str = None,
     run_id: str = None,
 ):
-    shops = ",".join(batch.astype(str))
+    """Rows of the shops in ``batch``, the shop ids are joined from a temporary
+    table rather than listed in the query, see ``DB.get_by_ids``.
+    """
+    where = None
     if run_id_col is not None:
-        tbl = conn.get(
-            f"""SELECT *
-                           FROM {table_schema}.{table_name}
-                           WHERE {run_id_col} = '{run_id}'
-                           AND shop_id in ({shops});
-                        """,
-            optimize_verbose=False,
-            timing_verbose=False,
-        )
-    else:
-        tbl = conn.get(
-            f"""SELECT *
-                           FROM {table_schema}.{table_name}
-                           WHERE shop_id in ({shops});
-                        """,
-            optimize_verbose=False,
-            timing_verbose=False,
-        )
-    return tbl
+        where = f"t.{run_id_col} = '{run_id}'"
+    return conn.get_by_ids(
+        f"{table_schema}.{table_name}",
+        batch,
+        id_col="shop_id",
+        where=where,
+        optimize_verbose=False,
+        timing_verbose=False,
+    )
 
 
 def preprocess_activities(
@@ -302,6 +842,8 @@ def preprocess_activities(
     Function to tranform activities in v1_daily_feature/v1_daily_future_features stored as list
     into dummy variables used in xgboost model.
     """
+    import pandas as pd
+
     activities = pd.get_dummies(
         shop_data.set_index("date")[activities_column]
         .apply(lambda x: json.loads(x) if pd.notnull(x) else None)
@@ -347,18 +889,48 @@ def join_coordinates(tbl: pd.DataFrame) -> pd.Series:
 def remove_special_char(
     my_str: str, replace_ws: bool = False, escape_punct: bool = True
 ) -> str:
+    from unidecode import unidecode
+
     if isinstance(my_str, float):
         my_str = str(my_str)
     my_str = unidecode(my_str)
     if escape_punct:
-        chars = re.escape(string.punctuation)
-        my_str = re.sub(r"[" + chars + "]", "", my_str)
-    my_str = re.sub("  ", " ", my_str)
+        my_str = my_str.translate(PUNCTUATION_TABLE)
+    my_str = my_str.replace("  ", " ")
     if replace_ws:
-        my_str = re.sub(" ", "\\\s?", my_str)
+        my_str = my_str.replace(" ", "\\s?")
     return my_str.lower()
 
 
+def remove_special_char_series(
+    values: pd.Series, replace_ws: bool = False, escape_punct: bool = True
+) -> pd.Series:
+    """Vectorized ``remove_special_char`` over a series of strings.
+
+    Only the distinct values are normalized, the results are mapped back to the rows
+    through the factorized codes, so the cost grows with the number of distinct
+    strings rather than the number of rows.
+
+    Examples:
+
+        .. code-block:: python
+
+            shops["name_clean"] = remove_special_char_series(shops["name"])
+    """
+    import numpy as np
+    import pandas as pd
+
+    values = pd.Series(values, copy=False)
+    codes, uniques = pd.factorize(values)
+    normalized = np.array(
+        [remove_special_char(x, replace_ws, escape_punct) for x in uniques]
+        # factorize codes missing values as -1, they land on the last element
+        + [remove_special_char(np.nan, replace_ws, escape_punct)],
+        dtype=object,
+    )
+    return pd.Series(normalized[codes], index=values.index, name=values.name)
+
+
 def list_to_dict(category_list: list) -> dict:
     return dict(zip([category_list], [1]))
 
@@ -367,7 +939,11 @@ def estimate_similarity(df: pd.DataFrame, fill_na: bool = False):
     """Estimates similarity matrix according to euclidean distance.
     The result is scaled to 0-1.
     Argument provided whether to fill NA's as 0's.
+    See ``samesyslib.similarity.SimilarityStore`` for repeated lookups.
     """
+    import numpy as np
+    from sklearn.metrics.pairwise import nan_euclidean_distances
+
     df = df.reset_index(level=0)
     if fill_na:
         df = df.fillna(0)
@@ -394,6 +970,7 @@ def filter_rows_and_cols(df: pd.DataFrame, filter_list: list):
 def percentile(n: int):
     """Percentile function that can be passed to pandas agg() function
     AND changes column name.
+    Use ``group_quantiles`` for several percentiles of many groups.
     """
 
     def percentile_(x):
@@ -403,6 +980,148 @@ def percentile(n: int):
     return percentile_
 
 
+def _sorted_group_quantiles(codes, values, n_groups: int, q: list):
+    """Linear interpolated quantiles of ``values`` per group code, one sort."""
+    import numpy as np
+
+    valid = ~np.isnan(values) & (codes >= 0)
+    codes, values = codes[valid], values[valid]
+    order = np.lexsort((values, codes))
+    values = values[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    empty = counts == 0
+    last = np.maximum(counts - 1, 0)
+
+    result = np.full((n_groups, len(q)), np.nan)
+    for i, quantile in enumerate(q):
+        position = last * quantile
+        below = np.floor(position).astype(np.int64)
+        above = np.minimum(below + 1, last)
+        fraction = position - below
+        lower = values[np.where(empty, 0, starts + below)] if len(values) else 0.0
+        upper = values[np.where(empty, 0, starts + above)] if len(values) else 0.0
+        interpolated = np.where(fraction > 0, lower + (upper - lower) * fraction, lower)
+        result[:, i] = np.where(empty, np.nan, interpolated)
+    return result
+
+
+def group_quantiles(
+    df: pd.DataFrame,
+    by: Union[str, List[str]],
+    columns: Union[str, List[str]],
+    q: Iterable[float] = (0.1, 0.5, 0.9),
+    observed: bool = False,
+) -> pd.DataFrame:
+    """Several quantiles of ``columns`` per group, sorting every group once.
+
+    Same values as ``df.groupby(by, observed=observed)[columns].agg([percentile(n)
+    for n in q])``, columns named ``q<n>`` likewise, nested under the column name
+    when ``columns`` is a list. ``agg`` sorts each group again for every quantile,
+    here all values are sorted by group and value once and the quantiles are
+    read off the sorted array for all groups at the same time. Rows with a
+    missing key belong to no group, unobserved categories of categorical keys
+    get NaN rows unless ``observed`` is set.
+
+    Examples:
+
+        .. code-block:: python
+
+            group_quantiles(sales, ["shop_id", "hour"], "amount", q=[0.1, 0.5, 0.9])
+    """
+    import numpy as np
+    import pandas as pd
+
+    q = list(q)
+    grouped = df.groupby(by, sort=True, observed=True)
+    # NaN for rows with a missing key, -1 leaves them out of every group
+    codes = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    keys = grouped.size().index
+    names = ["q%s" % n for n in q]
+    if not observed:
+        every_key = df.groupby(by, sort=True, observed=False).size().index
+
+    frames = {}
+    for column in [columns] if isinstance(columns, str) else columns:
+        values = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        frames[column] = pd.DataFrame(
+            _sorted_group_quantiles(codes, values, len(keys), q),
+            index=keys,
+            columns=names,
+        )
+        if not observed:
+            frames[column] = frames[column].reindex(every_key)
+    if isinstance(columns, str):
+        return frames[columns]
+    return pd.concat(frames, axis=1)
+
+
+class QuantileSketch:
+    """Approximate ``group_quantiles`` over frames arriving one at a time.
+
+    Keeps a uniform sample of at most ``size`` rows per group, bottom-k sampling
+    on random priorities, so the memory is bounded by groups times ``size`` however
+    many rows stream through. Quantiles of groups that saw up to ``size`` rows are
+    exact.
+
+    Examples:
+
+        .. code-block:: python
+
+            sketch = QuantileSketch(["shop_id", "hour"], "amount", size=2048)
+            for chunk in events.iter_chunks():
+                sketch.update(chunk)
+            sketch.result(q=[0.5, 0.99])
+    """
+
+    PRIORITY = "_sketch_priority"
+
+    def __init__(
+        self,
+        by: Union[str, List[str]],
+        columns: Union[str, List[str]],
+        size: int = 1024,
+        random_state: int = None,
+    ):
+        import numpy as np
+
+        self.by = by
+        self.columns = columns
+        self.size = size
+        self.rows = 0
+        self._sample = None
+        self._rng = np.random.default_rng(random_state)
+
+    def update(self, df: pd.DataFrame):
+        keys = [self.by] if isinstance(self.by, str) else list(self.by)
+        values = [self.columns] if isinstance(self.columns, str) else self.columns
+        batch = df[keys + list(values)].assign(
+            **{self.PRIORITY: self._rng.random(df.shape[0])}
+        )
+        self.rows += df.shape[0]
+        self._keep(batch)
+
+    def merge(self, other: QuantileSketch):
+        """Add the sample of a sketch of the same groups, e.g. from another process"""
+        if other._sample is not None:
+            self.rows += other.rows
+            self._keep(other._sample)
+
+    def _keep(self, batch: pd.DataFrame):
+        """Lowest ``size`` priorities per group of the sample and ``batch``"""
+        import pandas as pd
+
+        if self._sample is not None:
+            batch = pd.concat([self._sample, batch], ignore_index=True)
+        batch = batch.sort_values(self.PRIORITY, kind="stable")
+        self._sample = batch.groupby(self.by, sort=False).head(self.size)
+
+    def result(self, q: Iterable[float] = (0.1, 0.5, 0.9)) -> pd.DataFrame:
+        if self._sample is None:
+            raise ValueError("No rows seen yet")
+        return group_quantiles(self._sample, self.by, self.columns, q)
+
+
 def get_branch_commit_from_mapping(query, conn):
     result_set = conn.execute(query, verbose=True).first()
     assert (
@@ -18,6 +18,6 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     packages=setuptools.find_packages(),
-    install_requires=["ruamel.yaml", "sqlalchemy", "pandas", "pymysql", "pydantic"],
+    install_requires=["ruamel.yaml", "sqlalchemy", "pandas", "pymysql", "pydantic", "unidecode"],
     python_requires=">=3.7",
 )
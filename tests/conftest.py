@@ -0,0 +1,90 @@
+import csv
+import re
+
+import pytest
+
+LOAD_DATA = re.compile(
+    r"LOAD DATA LOCAL INFILE '(?P<path>[^']+)'\s+(?P<replace>REPLACE\s+)?"
+    r"INTO TABLE\s+(?P<table>\S+).*?LINES\s*(?:\((?P<columns>[^)]*)\))?",
+    re.S,
+)
+RENAME_TABLE = re.compile(r"RENAME TABLE (?P<old>\S+) TO (?:\w+\.)?(?P<new>\w+)")
+ADD_INDEX = re.compile(r"ADD INDEX (?P<name>`\w+`) (?P<columns>\([^)]*\))")
+
+
+@pytest.fixture
+def sqlite_db():
+    """DB backed by an in-memory SQLite database, schema "main".
+
+    Covers the SQL shared by MySQL and SQLite, LOAD DATA and MySQL DDL excluded.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import StaticPool
+
+    from samesyslib.db import DB
+
+    engine = create_engine(
+        "sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False}
+    )
+    db = DB.from_engine(engine, schema="main")
+    yield db
+    db.engine.dispose()
+
+
+@pytest.fixture
+def loading_db(sqlite_db):
+    """``sqlite_db`` running the MySQL statements of the LOAD DATA writes.
+
+    ``LOAD DATA LOCAL INFILE`` inserts the rows of the CSV file in the current
+    transaction, ``USE`` is ignored, ``RENAME TABLE`` becomes ``ALTER TABLE`` and
+    ``ALTER TABLE ... ADD INDEX`` and ``DROP TABLE`` of several tables one
+    statement per index or table.
+    The tables loaded are listed in ``loads``, the loads whose position is in
+    ``failing_loads`` raise.
+    """
+    from sqlalchemy import event
+
+    sqlite_db.loads = []
+    sqlite_db.failing_loads = set()
+
+    def translate(conn, cursor, statement, parameters, context, executemany):
+        stripped = statement.strip()
+        load = LOAD_DATA.match(stripped)
+        if load:
+            position = len(sqlite_db.loads)
+            sqlite_db.loads.append(load["table"])
+            if position in sqlite_db.failing_loads:
+                raise OSError(f"load {position} failed")
+            with open(load["path"], newline="", encoding="utf-8") as f:
+                header, *rows = csv.reader(f)
+            columns = load["columns"] or ", ".join(f"`{name}`" for name in header)
+            rows = [[None if v == "NULL" else v for v in row] for row in rows]
+            markers = ", ".join("?" * len(header))
+            verb = "INSERT OR REPLACE" if load["replace"] else "INSERT"
+            cursor.executemany(
+                f"{verb} INTO {load['table']} ({columns}) VALUES ({markers})", rows
+            )
+            return "SELECT 1", ()
+        if stripped.startswith("USE "):
+            return "SELECT 1", ()
+        if stripped.startswith("DROP TABLE IF EXISTS") and "," in stripped:
+            tables = stripped[len("DROP TABLE IF EXISTS") :].rstrip(";").split(",")
+            for table in tables:
+                cursor.execute(f"DROP TABLE IF EXISTS {table.strip()}")
+            return "SELECT 1", ()
+        if stripped.startswith("ALTER TABLE") and "ADD INDEX" in stripped:
+            schema, table = stripped.split()[2].rpartition(".")[::2]
+            schema = f"{schema}." if schema else ""
+            for index in ADD_INDEX.finditer(stripped):
+                cursor.execute(
+                    f"CREATE INDEX {schema}{index['name']} ON {table} "
+                    f"{index['columns']}"
+                )
+            return "SELECT 1", ()
+        rename = RENAME_TABLE.match(stripped)
+        if rename:
+            return f"ALTER TABLE {rename['old']} RENAME TO {rename['new']}", ()
+        return statement, parameters
+
+    event.listen(sqlite_db.engine, "before_cursor_execute", translate, retval=True)
+    yield sqlite_db
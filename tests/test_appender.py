@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from samesyslib.appender import Appender, check_compatible
+
+COLUMNS = {
+    "id": ("int", None),
+    "shop": ("varchar", 5),
+    "amount": ("decimal", None),
+    "created": ("datetime", None),
+}
+
+
+def test_check_compatible():
+    check_compatible(
+        pd.DataFrame(
+            {
+                "id": [1.0, np.nan],  # whole numbers with NULLs arrive as floats
+                "shop": ["a", None],
+                "amount": [1, 2],
+                "created": pd.to_datetime(["2024-01-01", None]),
+            }
+        ),
+        COLUMNS,
+    )
+    with pytest.raises(TypeError):
+        check_compatible(pd.DataFrame({"id": [1.5]}), COLUMNS)
+    with pytest.raises(TypeError):
+        check_compatible(pd.DataFrame({"amount": ["a lot"]}), COLUMNS)
+    with pytest.raises(TypeError):
+        check_compatible(pd.DataFrame({"shop": ["too long"]}), COLUMNS)
+    with pytest.raises(ValueError):
+        check_compatible(pd.DataFrame({"missing": [1]}), COLUMNS)
+
+
+class FakeDB:
+    _schema = "main"
+    _shard = None
+
+    def __init__(self):
+        self.lookups = 0
+
+    def table_schema(self, table, schema=None, refresh=False):
+        self.lookups += 1
+        return COLUMNS
+
+
+def test_appender_coalesces(monkeypatch):
+    batches = []
+    monkeypatch.setattr(Appender, "_load", lambda self, batch: batches.append(batch))
+    db = FakeDB()
+
+    appender = Appender(db, "sales", max_rows=5, max_delay=None)
+    for i in range(7):
+        appender.append(pd.DataFrame({"amount": [i], "id": [i]}))
+    assert len(batches) == 1
+    assert list(batches[0].columns) == ["id", "amount"]  # table order
+    assert batches[0]["id"].tolist() == [0, 1, 2, 3, 4]
+    assert appender.pending_rows == 2
+
+    with pytest.raises(TypeError):
+        appender.append(pd.DataFrame({"id": ["x"]}))
+    appender.close()
+    assert [len(b) for b in batches] == [5, 2]
+    assert db.lookups == 1
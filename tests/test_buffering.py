@@ -0,0 +1,94 @@
+import atexit
+import threading
+
+import pytest
+
+from samesyslib.buffering import BufferedWriter
+
+
+class ListWriter(BufferedWriter):
+    def __init__(self, max_items=3, flush_delay=None, fail=False):
+        super().__init__(flush_delay=flush_delay)
+        self.max_items = max_items
+        self.fail = fail
+        self.items = []
+        self.batches = []
+        self.written = threading.Event()
+
+    def add(self, item):
+        with self._lock:
+            self.items.append(item)
+            full = self._buffered()
+        if full:
+            self.flush()
+
+    def _full(self):
+        return len(self.items) >= self.max_items
+
+    def _take(self):
+        if not self.items:
+            return None
+        items, self.items = self.items, []
+        return items
+
+    def _write(self, pending):
+        if self.fail:
+            raise OSError("write failed")
+        self.batches.append(pending)
+        self.written.set()
+
+    def _restore(self, pending):
+        self.items = pending + self.items
+
+
+def test_buffered_writer_flushes_on_size_and_close(monkeypatch):
+    unregistered = []
+    monkeypatch.setattr(atexit, "unregister", unregistered.append)
+
+    with ListWriter(max_items=3) as writer:
+        for i in range(4):
+            writer.add(i)
+        assert writer.batches == [[0, 1, 2]]
+
+    assert writer.batches == [[0, 1, 2], [3]]
+    assert unregistered == [writer._exit_flush]
+
+
+def test_buffered_writer_not_kept_alive_by_atexit(monkeypatch):
+    import gc
+    import weakref
+
+    registered = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+
+    writer = ListWriter()
+    writer.add("a")
+    registered[0]()  # flushes the writer while it is alive
+    assert writer.batches == [["a"]]
+
+    ref = weakref.ref(writer)
+    del writer
+    gc.collect()
+    assert ref() is None
+    registered[0]()  # and does nothing once it is gone
+
+
+def test_buffered_writer_flushes_on_delay():
+    writer = ListWriter(max_items=100, flush_delay=0.01)
+    writer.add("a")
+
+    assert writer.written.wait(5)
+    assert writer.batches == [["a"]]
+    writer.close()
+
+
+def test_buffered_writer_keeps_failed_writes():
+    writer = ListWriter(fail=True)
+    writer.add("a")
+
+    with pytest.raises(OSError):
+        writer.flush()
+    writer.add("b")
+    writer.fail = False
+    writer.close()
+    assert writer.batches == [["a", "b"]]
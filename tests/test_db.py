@@ -0,0 +1,336 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from samesyslib.db import add_indexes_statement, create_table_statement
+
+
+def test_create_table_statement():
+    pdf = pd.DataFrame(
+        {
+            "shop_id": np.array([1, 2, 300], dtype=np.int64),
+            "delta": [-5, 0, 100],
+            "amount": [0.5, 1.25, np.nan],
+            "price": [0.1, 0.2, 0.3],
+            "day": pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-03"]),
+            "at": pd.to_datetime(["2024-01-01 10:00", None, "2024-01-03 00:00"]),
+            "code": ["ab", "abcd", "ab"],
+            "status": ["new", "done", "new"],
+            "note": ["x" * 5000, "", None],
+            "visits": [1, np.nan, 70000],
+            "orders": pd.array([None, 2, 3], dtype="Int64"),
+        }
+    )
+    statement = create_table_statement(
+        pdf, "sales", primary_key=["shop_id", "status"], enum_max_values=2
+    )
+    lines = [line.strip().rstrip(",") for line in statement.splitlines()[1:-1]]
+    assert lines == [
+        "`shop_id` SMALLINT UNSIGNED NOT NULL",
+        "`delta` TINYINT",
+        "`amount` FLOAT",
+        "`price` DOUBLE",
+        "`day` DATE",
+        "`at` DATETIME",
+        "`code` ENUM('ab', 'abcd')",
+        "`status` VARCHAR(4) NOT NULL",  # key columns are never ENUM
+        "`note` TEXT",
+        "`visits` MEDIUMINT UNSIGNED",  # integers with NULLs stay integers
+        "`orders` TINYINT UNSIGNED",
+        "PRIMARY KEY (`shop_id`, `status`)",
+    ]
+
+
+def test_add_indexes_statement():
+    assert add_indexes_statement("s.sales", ["day", ["shop_id", "day"]]) == (
+        "ALTER TABLE s.sales ADD INDEX `ix_day` (`day`), "
+        "ADD INDEX `ix_shop_id_day` (`shop_id`, `day`);"
+    )
+
+
+def test_get_by_ids(sqlite_db):
+    sqlite_db.execute("CREATE TABLE sales (shop_id INT, run_id TEXT, amount REAL)")
+    sqlite_db.execute(
+        "INSERT INTO sales VALUES (1, 'a', 1.0), (2, 'a', 2.0), (3, 'a', 3.0), "
+        "(3, 'b', 4.0)"
+    )
+
+    result = sqlite_db.get_by_ids(
+        "main.sales", np.array([3, 1, 3, 7]), where="t.run_id = 'a'"
+    )
+    assert sorted(result["amount"]) == [1.0, 3.0]
+    assert list(result.columns) == ["shop_id", "run_id", "amount"]
+
+    with sqlite_db.temporary_ids(["x", "yy"], column="code") as (conn, ids):
+        assert conn.execute(f"SELECT COUNT(*) FROM {ids}").scalar() == 2
+    assert sqlite_db.get("SELECT * FROM sqlite_temp_master").empty
+
+
+def test_get_many(sqlite_db):
+    import pytest
+
+    sqlite_db.execute("CREATE TABLE shops (shop_id INT)")
+    sqlite_db.execute("INSERT INTO shops VALUES (1), (2)")
+
+    frames = sqlite_db.get_many(
+        {"shops": "SELECT * FROM shops", "one": "SELECT 1 AS x"}, max_concurrency=2
+    )
+    assert list(frames) == ["shops", "one"]
+    assert frames["shops"]["shop_id"].tolist() == [1, 2]
+    assert frames["one"]["x"].tolist() == [1]
+
+    assert list(sqlite_db.get_many(["SELECT 1 AS x", "SELECT 2 AS x"])) == [0, 1]
+    with pytest.raises(Exception, match="no such table"):
+        sqlite_db.get_many({"ok": "SELECT 1", "broken": "SELECT * FROM missing"})
+
+    future = sqlite_db.submit_get("SELECT COUNT(*) AS n FROM shops")
+    assert future.result()["n"][0] == 2
+
+
+def test_batch_bounds():
+    from samesyslib.inserts import batch_bounds
+
+    sizes = np.array([4, 4, 4, 10, 1, 1])
+    assert batch_bounds(sizes, 8) == [(0, 2), (2, 3), (3, 4), (4, 6)]
+    assert batch_bounds(sizes, 100, max_rows=4) == [(0, 4), (4, 6)]
+
+
+def test_row_bytes_multibyte():
+    from samesyslib.inserts import row_bytes
+
+    pdf = pd.DataFrame({"name": ["abc", "ąžū", "日本", "it's"]})
+    # quotes, separator and parentheses, then UTF-8 bytes and escapes
+    assert row_bytes(pdf).tolist() == [6 + 3, 6 + 6, 6 + 6, 6 + 5]
+
+
+def test_send_single_native(sqlite_db):
+    sales = pd.DataFrame(
+        {
+            "shop_id": np.arange(500),
+            "amount": np.where(np.arange(500) % 7 == 0, np.nan, 1.5),
+            "name": [None if i % 5 == 0 else f"shop {i}" for i in range(500)],
+            "day": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.arange(500), "h"),
+            "open": np.arange(500) % 2 == 0,
+        }
+    )
+    sqlite_db._max_allowed_packet = 16 * 1024 + 2000  # a dozen batches
+
+    sqlite_db.send_single(sales, "sales", schema="main")
+    result = sqlite_db.get("SELECT * FROM sales ORDER BY shop_id")
+    assert result.shape == (500, 5)
+    assert result["amount"].isna().sum() == sales["amount"].isna().sum()
+    assert result["name"].isna().sum() == 100
+    assert result["day"][25] == "2024-01-02T01:00:00.000000"
+
+    sqlite_db.send_single(sales, "sales", schema="main", if_exists="append")
+    assert sqlite_db.get("SELECT COUNT(*) AS n FROM sales")["n"][0] == 1000
+
+    # both paths raise
+    for method in ("multi", None):
+        with pytest.raises(ValueError, match="already exists"):
+            sqlite_db.send_single(
+                sales, "sales", schema="main", if_exists="fail", method=method
+            )
+
+
+def test_send_single_native_types_from_whole_frame(sqlite_db):
+    import datetime
+
+    pdf = pd.DataFrame(
+        {
+            "day": [datetime.date(2024, 1, 1), datetime.date(2024, 1, 2)],
+            "count": pd.Series([1, 2], dtype=object),
+        }
+    )
+    sqlite_db.send_single(pdf, "daily", schema="main")
+    columns = sqlite_db.get("PRAGMA table_info(daily)").set_index("name")
+    assert columns["type"].to_dict() == {"day": "DATE", "count": "BIGINT"}
+
+
+def test_send_single_native_chunksize(sqlite_db, monkeypatch):
+    from samesyslib.inserts import InsertWriter
+
+    sizes = []
+    send = InsertWriter._send
+
+    def counting_send(self, idle, statement, rows, packet):
+        sizes.append(len(rows))
+        return send(self, idle, statement, rows, packet)
+
+    monkeypatch.setattr(InsertWriter, "_send", counting_send)
+    pdf = pd.DataFrame({"id": range(25)})
+    sqlite_db.send_single(pdf, "ids", schema="main", chunksize=10)
+    assert sizes == [10, 10, 5]
+    assert sqlite_db.get("SELECT COUNT(*) AS n FROM ids")["n"][0] == 25
+
+
+def test_send_single_native_rolls_back(sqlite_db, monkeypatch):
+    from samesyslib.inserts import InsertWriter
+
+    sent = []
+    send = InsertWriter._send
+
+    def failing_send(self, idle, statement, rows, packet):
+        if sent:
+            raise OSError("connection lost")
+        sent.append(len(rows))
+        return send(self, idle, statement, rows, packet)
+
+    monkeypatch.setattr(InsertWriter, "_send", failing_send)
+    pdf = pd.DataFrame({"id": range(25)})
+    sqlite_db.execute("CREATE TABLE ids (id INTEGER)")
+    with pytest.raises(OSError, match="connection lost"):
+        sqlite_db.send_single(
+            pdf, "ids", schema="main", if_exists="append", chunksize=10
+        )
+    # the first batch went through but was never committed
+    assert sent == [10]
+    assert sqlite_db.get("SELECT COUNT(*) AS n FROM ids")["n"][0] == 0
+
+
+def checkpoints(db):
+    rows = db.execute("SELECT chunk_id, `rows` FROM _samesyslib_load_chunks")
+    return sorted(tuple(row) for row in rows.fetchall())
+
+
+def test_send_resumable(loading_db):
+    from sqlalchemy import inspect
+
+    pdf = pd.DataFrame({"id": range(5), "name": list("abcde")})
+    loading_db.failing_loads = {1}
+
+    with pytest.raises(OSError):
+        loading_db.send(pdf, "sales", resumable=True, chunk_rows=2, retries=0)
+    # the first chunk landed with its checkpoint, the failed one rolled back
+    assert checkpoints(loading_db) == [(0, 2)]
+    assert loading_db.get("SELECT COUNT(*) AS n FROM sales_tmp")["n"][0] == 2
+
+    loading_db.send(pdf, "sales", resumable=True, chunk_rows=2, retries=0)
+    assert len(loading_db.loads) == 4  # chunks 0 and 1, then 1 and 2
+    result = loading_db.get("SELECT * FROM sales ORDER BY id")
+    assert result["id"].tolist() == list(range(5))
+    assert result["name"].tolist() == list("abcde")
+    assert checkpoints(loading_db) == []
+    assert not inspect(loading_db.engine).has_table("sales_tmp")
+
+
+def test_send_resumable_other_frame_restarts(loading_db):
+    pdf = pd.DataFrame({"id": range(5), "name": list("abcde")})
+    loading_db.failing_loads = {1}
+    with pytest.raises(OSError):
+        loading_db.send(pdf, "sales", resumable=True, chunk_rows=2, retries=0)
+
+    # same shape and edges, another middle row: nothing is resumed
+    changed = pdf.assign(name=list("abXde"))
+    loading_db.send(changed, "sales", resumable=True, chunk_rows=2, retries=0)
+    assert len(loading_db.loads) == 5
+    result = loading_db.get("SELECT name FROM sales ORDER BY id")
+    assert result["name"].tolist() == list("abXde")
+
+
+def test_send_forgets_table_schema(loading_db):
+    pdf = pd.DataFrame({"id": [1, 2]})
+    for resumable in (False, True):
+        loading_db._schema_cache = {("main", "sales"): {"old": ("text", None)}}
+        loading_db.send(pdf, "sales", resumable=resumable)
+        assert loading_db._schema_cache == {}
+
+
+def test_send_primary_key_and_indexes(loading_db):
+    pdf = pd.DataFrame(
+        {
+            "shop_id": [1, 1, 2],
+            "day": pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-01"]),
+            "visits": [10, np.nan, 7],
+        }
+    )
+    for resumable in (False, True):
+        loading_db.send(
+            pdf,
+            "sales",
+            resumable=resumable,
+            primary_key=["shop_id", "day"],
+            indexes=["day", ["visits", "day"]],
+        )
+
+        columns = loading_db.get("PRAGMA table_info(sales)").set_index("name")
+        assert columns["type"].to_dict() == {
+            "shop_id": "TINYINT UNSIGNED",
+            "day": "DATE",
+            "visits": "TINYINT UNSIGNED",
+        }
+        assert columns["pk"].to_dict() == {"shop_id": 1, "day": 2, "visits": 0}
+        indexes = loading_db.get("PRAGMA index_list(sales)")
+        assert {"ix_day", "ix_visits_day"} <= set(indexes["name"])
+        assert loading_db.get("SELECT * FROM sales").shape == (3, 3)
+        # index names are per table in MySQL but per schema in SQLite
+        loading_db.execute("DROP INDEX ix_day")
+        loading_db.execute("DROP INDEX ix_visits_day")
+
+
+def test_run_script_keeps_trailing_comments_apart(sqlite_db, monkeypatch):
+    import sqlite3
+
+    scripts = []
+
+    class ScriptCursor:
+        rowcount = -1
+
+        def __init__(self, connection):
+            self.connection = connection
+
+        def execute(self, sql):
+            scripts.append(sql)
+            self.connection.executescript(sql)
+
+        def nextset(self):
+            return False
+
+    class ScriptConnection:
+        def __init__(self):
+            self.connection = sqlite3.connect(":memory:")
+            self.connection.executescript(
+                "CREATE TABLE a (x INT); CREATE TABLE b (y INT);"
+                "INSERT INTO a VALUES (0); INSERT INTO b VALUES (1);"
+            )
+
+        def cursor(self):
+            return ScriptCursor(self.connection)
+
+        def commit(self):
+            pass
+
+        def close(self):
+            pass
+
+    connection = ScriptConnection()
+    monkeypatch.setattr(sqlite_db, "_multi_statement_connection", lambda: connection)
+
+    sqlite_db.run_script("UPDATE a SET x=1 -- fix totals\n;\nDELETE FROM b;")
+    assert scripts == ["UPDATE a SET x=1 -- fix totals\n;\nDELETE FROM b"]
+    assert connection.connection.execute("SELECT x FROM a").fetchall() == [(1,)]
+    assert connection.connection.execute("SELECT * FROM b").fetchall() == []
+
+
+def test_send_resumable_other_chunk_rows_restarts(loading_db):
+    pdf = pd.DataFrame({"id": range(6)})
+    loading_db.failing_loads = {1}
+    with pytest.raises(OSError):
+        loading_db.send(pdf, "sales", resumable=True, chunk_rows=2, retries=0)
+
+    # chunk 0 of 3 rows is not the chunk 0 of 2 rows that landed
+    loading_db.send(pdf, "sales", resumable=True, chunk_rows=3, retries=0)
+    assert len(loading_db.loads) == 4
+    result = loading_db.get("SELECT id FROM sales ORDER BY id")
+    assert result["id"].tolist() == list(range(6))
+
+    # the checkpoints are checked for an explicit load_id too
+    loading_db.failing_loads = {5}
+    with pytest.raises(OSError):
+        loading_db.send(
+            pdf, "sales", resumable=True, chunk_rows=2, load_id="x", retries=0
+        )
+    loading_db.send(pdf, "sales", resumable=True, chunk_rows=4, load_id="x")
+    assert len(loading_db.loads) == 8
+    result = loading_db.get("SELECT id FROM sales ORDER BY id")
+    assert result["id"].tolist() == list(range(6))
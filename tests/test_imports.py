@@ -0,0 +1,65 @@
+import subprocess
+import sys
+
+import pytest
+
+PUBLIC_MODULES = [
+    "samesyslib",
+    "samesyslib.db",
+    "samesyslib.db_config",
+    "samesyslib.shards",
+    "samesyslib.utils",
+]
+HEAVY_DEPENDENCIES = {"numpy", "pandas", "sqlalchemy", "pydantic"}
+# generous bound on the cumulative import time, the real guard is that heavy
+# dependencies stay out of it
+IMPORT_TIME_BUDGET_US = 500000
+
+
+def import_times(module: str) -> dict:
+    """Cumulative import time in microseconds of every module imported by ``module``"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("module", PUBLIC_MODULES)
+def test_import_is_lazy(module):
+    times = import_times(module)
+
+    heavy = {name for name in times if name.split(".")[0] in HEAVY_DEPENDENCIES}
+    assert not heavy, f"{module} imports {sorted(heavy)} at import time"
+    assert times[module] < IMPORT_TIME_BUDGET_US
+
+
+def test_environment_read_on_use(monkeypatch):
+    from samesyslib import db_config
+
+    monkeypatch.setenv("DB_ENVIRONMENT", "prod")
+    monkeypatch.setenv("CONFIG_PATH", "settings/config.yml")
+
+    assert db_config.DEFAULT_ENV == "prod"
+    assert db_config.CONFIG_PATH == "settings/config.yml"
+
+
+def test_shards_settings_models_pickle():
+    import pickle
+
+    from samesyslib.shards import Shard, ShardsSettings
+
+    shard = Shard(
+        name="shard1", host="db", port=3306, login="l", password="p", schema="s"
+    )
+    assert pickle.loads(pickle.dumps(shard)) == shard
+    settings = ShardsSettings(SHARDS=[shard])
+    assert pickle.loads(pickle.dumps(settings)).SHARDS == [shard]
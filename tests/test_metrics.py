@@ -0,0 +1,57 @@
+import pytest
+from samesyslib.metrics import Histogram, MetricsRegistry
+
+
+def test_histogram():
+    histogram = Histogram()
+    for value in [0, 0.001, 0.01, 0.1, 1, 10]:
+        histogram.observe(value)
+
+    summary = histogram.summary()
+    assert summary["count"] == 6
+    assert summary["min"] == 0
+    assert summary["max"] == 10
+    assert summary["sum"] == pytest.approx(11.111)
+    assert 0.01 <= summary["p50"] <= 0.01 * 2**0.25
+    assert summary["p99"] == 10
+
+
+def test_operation_phases_and_exporter():
+    registry = MetricsRegistry()
+    events = []
+    registry.add_exporter(events.append)
+
+    with registry.operation("get", shard="shardK") as op:
+        with op.phase("execute"):
+            pass
+        with op.phase("fetch"):
+            pass
+        op.rows = 10
+        op.bytes = 80
+
+    assert len(events) == 1
+    assert events[0]["operation"] == "get"
+    assert events[0]["labels"] == {"shard": "shardK"}
+    assert set(events[0]["phases"]) == {"execute", "fetch"}
+    assert events[0]["error"] is None
+    metrics = registry.snapshot()["get"]
+    assert metrics["rows"]["sum"] == 10
+    assert metrics["phase.fetch"]["count"] == 1
+
+
+def test_operation_error_and_failing_exporter():
+    registry = MetricsRegistry()
+    events = []
+
+    def broken(event):
+        raise RuntimeError("exporter down")
+
+    registry.add_exporter(broken)
+    registry.add_exporter(events.append)
+
+    with pytest.raises(ValueError):
+        with registry.operation("send"):
+            raise ValueError("lock wait timeout")
+
+    assert events[0]["error"] == "lock wait timeout"
+    assert registry.snapshot()["send"]["errors"]["count"] == 1
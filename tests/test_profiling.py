@@ -0,0 +1,74 @@
+import contextvars
+import json
+import threading
+
+from samesyslib import profiling as profiling_module
+from samesyslib.db import timing
+from samesyslib.profiling import profiling
+
+
+@timing
+def allocate(n):
+    return inner(n)
+
+
+@timing
+def inner(n):
+    return [bytes(1000) for _ in range(n)]
+
+
+def test_profiling_disabled(monkeypatch):
+    profiled = []
+    monkeypatch.setattr(profiling_module, "_env_settings", None)
+    monkeypatch.setattr(
+        profiling_module, "_profile", lambda *args: profiled.append(args)
+    )
+
+    assert len(allocate(10)) == 10
+    assert profiled == []
+
+
+def test_profiling_reports(tmpdir):
+    with profiling(output_dir=tmpdir.strpath, cpu=True, top=3):
+        data = allocate(1000)
+
+    reports = [f for f in tmpdir.listdir() if f.ext == ".json"]
+    assert len(reports) == 1  # the nested call is part of the outer profile
+    report = json.loads(reports[0].read_text("utf-8"))
+    assert report["function"] == "allocate"
+    assert report["peak_mb"] > 0.9
+    assert not report["peak_shared"]
+    assert len(report["top_allocations"]) == 3
+    assert "test_profiling.py" in report["top_allocations"][0]["site"]
+    assert tmpdir.join(report["cprofile"].split("/")[-1]).check()
+    assert len(data) == 1000
+
+
+def test_profiling_sampling(tmpdir):
+    with profiling(output_dir=tmpdir.strpath, sample_rate=0):
+        allocate(10)
+    assert tmpdir.listdir() == []
+
+
+def test_profiling_overlapping_calls(tmpdir):
+    started, release = threading.Event(), threading.Event()
+
+    @timing
+    def wait():
+        started.set()
+        release.wait(5)
+
+    with profiling(output_dir=tmpdir.strpath):
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(wait,))
+        thread.start()
+        started.wait(5)
+        allocate(10)
+        release.set()
+        thread.join()
+
+    reports = [json.loads(f.read_text("utf-8")) for f in tmpdir.listdir()]
+    assert sorted(r["function"] for r in reports) == [
+        "allocate",
+        "test_profiling_overlapping_calls.<locals>.wait",
+    ]
+    assert all(r["peak_shared"] for r in reports)
@@ -0,0 +1,72 @@
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from samesyslib.replicas import ReplicaPool
+
+
+def sqlite_engine(name):
+    engine = create_engine(
+        "sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False}
+    )
+    engine.execute(f"CREATE TABLE served_by AS SELECT '{name}' AS name")
+    return engine
+
+
+def test_reads_go_to_healthy_replicas(sqlite_db, monkeypatch):
+    sqlite_db.execute("CREATE TABLE served_by AS SELECT 'primary' AS name")
+    lags = {"r1": 0.0, "r2": 0.0}
+    pool = ReplicaPool(
+        [(name, sqlite_engine(name)) for name in lags], max_lag=5, check_interval=0
+    )
+    names = {id(r.engine): r.name for r in pool.replicas}
+    monkeypatch.setattr(pool, "replication_lag", lambda e: lags[names[id(e)]])
+    sqlite_db._replicas = pool
+
+    def served_by(**kwargs):
+        return sqlite_db.get("SELECT name FROM served_by", **kwargs)["name"][0]
+
+    assert {served_by(), served_by()} == {"r1", "r2"}
+
+    lags["r1"] = 60.0  # lagging replicas are skipped
+    assert {served_by(), served_by()} == {"r2"}
+
+    lags["r2"] = None  # replication stopped
+    assert served_by() == "primary"
+
+    lags["r1"] = lags["r2"] = 0.0
+    assert served_by(use_primary=True) == "primary"
+    with sqlite_db.primary_reads():
+        assert served_by() == "primary"
+    assert served_by() != "primary"
+
+    # writes stay on the primary
+    sqlite_db.execute("CREATE TABLE written (x INT)")
+    assert sqlite_db.get("SELECT * FROM written", use_primary=True).empty
+
+
+def test_one_caller_checks_a_stale_replica(monkeypatch):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    pool = ReplicaPool([("r1", sqlite_engine("r1"))], check_interval=60)
+    probing, release = threading.Event(), threading.Event()
+    checks = []
+
+    def replication_lag(engine):
+        checks.append(engine)
+        probing.set()
+        release.wait(5)
+        return 0.0
+
+    monkeypatch.setattr(pool, "replication_lag", replication_lag)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first = executor.submit(pool.choose)
+        probing.wait(5)
+        # never checked and being checked: the other reads go to the primary
+        others = [executor.submit(pool.choose) for _ in range(3)]
+        assert [f.result(timeout=5) for f in others] == [None] * 3
+        release.set()
+        assert first.result(timeout=5).name == "r1"
+
+    assert pool.choose().name == "r1"  # fresh, not checked again
+    assert len(checks) == 1
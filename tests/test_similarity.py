@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from samesyslib.similarity import SimilarityStore
+from samesyslib.utils import filter_rows_and_cols
+
+
+def sample_matrix():
+    rng = np.random.default_rng(0)
+    x = rng.random((6, 6))
+    sim = (x + x.T) / 2
+    np.fill_diagonal(sim, 1.0)
+    ids = np.array([10, 11, 12, 13, 14, 15])
+    return pd.DataFrame(sim, index=ids, columns=ids.astype(str)), ids
+
+
+def test_triangle_store(tmpdir):
+    sim_df, ids = sample_matrix()
+    store = SimilarityStore.from_matrix(sim_df)
+
+    assert store.similarity(12, 14) == np.float32(sim_df.loc[12, "14"])
+    assert store.similarity(14, 12) == store.similarity(12, 14)
+
+    wanted = [15, 11, 12, 99]  # 99 is unknown
+    expected = filter_rows_and_cols(sim_df, wanted)
+    expected.columns = expected.columns.astype(int)
+    result = store.submatrix(wanted).loc[expected.index, expected.columns]
+    np.testing.assert_allclose(result, expected, rtol=1e-6)
+
+    store.save(tmpdir.strpath)
+    loaded = SimilarityStore.load(tmpdir.strpath)
+    assert isinstance(loaded._values, np.memmap)
+    pd.testing.assert_frame_equal(loaded.submatrix(wanted), store.submatrix(wanted))
+
+
+def test_top_k_store(tmpdir):
+    sim_df, ids = sample_matrix()
+    store = SimilarityStore.from_matrix(sim_df.to_numpy(), ids, top_k=3)
+    sim = sim_df.to_numpy()
+
+    for i, a in enumerate(ids):
+        top = set(np.argsort(-sim[i])[:3])
+        for j, b in enumerate(ids):
+            stored = j in top or i in set(np.argsort(-sim[j])[:3])
+            value = store.similarity(a, b)
+            assert np.isclose(value, sim[i, j]) if stored else np.isnan(value)
+
+    block = store.submatrix(ids)
+    for a in ids:
+        for b in ids:
+            expected = store.similarity(a, b)
+            assert np.array_equal(block.loc[a, b], expected, equal_nan=True)
+
+    store.save(tmpdir.strpath)
+    loaded = SimilarityStore.load(tmpdir.strpath)
+    assert loaded.kind == "top_k"
+    assert loaded.similarity(10, 10) == store.similarity(10, 10)
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from samesyslib.spill import SpilledFrame, SpillWriter
+
+
+def sample_chunks():
+    first = pd.DataFrame(
+        {
+            "shop_id": np.array([1, 2, 3], dtype=np.int64),
+            "sales": [1.5, np.nan, 3.0],
+            "name": ["Ąžuolas", None, "b"],
+            "date": pd.to_datetime(["2021-01-01", None, "2021-01-03"]),
+        }
+    )
+    # the second chunk brings NULLs into the integer column
+    second = pd.DataFrame(
+        {
+            "shop_id": [4.0, np.nan],
+            "sales": [5.0, 6.0],
+            "name": ["c", "dd"],
+            "date": pd.to_datetime(["2021-01-04", "2021-01-05"]),
+        }
+    )
+    return first, second
+
+
+def test_spill_round_trip(tmpdir):
+    writer = SpillWriter(tmpdir.strpath)
+    for chunk in sample_chunks():
+        assert writer.append(chunk) > 0
+    frame = writer.finish()
+
+    assert frame.shape == (5, 4)
+    assert frame.columns == ["shop_id", "sales", "name", "date"]
+    assert isinstance(frame.values("sales"), np.memmap)
+    assert frame.mask("shop_id").tolist() == [False] * 4 + [True]
+    assert frame["shop_id"].tolist()[:4] == [1, 2, 3, 4]
+    assert np.isnan(frame["shop_id"][4])
+    assert frame["name"].tolist() == ["Ąžuolas", None, "b", "c", "dd"]
+    assert frame.column("name", 3, 5).tolist() == ["c", "dd"]
+    assert frame["date"].isna().tolist() == [False, True, False, False, False]
+
+    chunks = list(frame.iter_chunks(2))
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    pd.testing.assert_frame_equal(pd.concat(chunks), frame.to_pandas())
+
+    # another process can open the same files without owning them
+    shared = SpilledFrame(frame.directory)
+    assert shared["name"][0] == "Ąžuolas"
+
+    frame.close()
+    assert tmpdir.listdir() == []
+
+
+def test_get_spills_columns_changing_type(sqlite_db, tmpdir):
+    rows = [
+        (None, 1, 1, 2**60),
+        (None, 2, 2, 1),
+        (7, 2.5, "a", 4),
+        (8, None, "b", None),
+    ]
+    sqlite_db.execute("CREATE TABLE mixed (later_int, to_float, to_str, whole)")
+    for row in rows:
+        sqlite_db.engine.execute("INSERT INTO mixed VALUES (?, ?, ?, ?)", row)
+
+    frame = sqlite_db.get(
+        "SELECT * FROM mixed",
+        spill_threshold_mb=0,
+        spill_chunksize=2,
+        spill_dir=tmpdir.strpath,
+    )
+
+    assert isinstance(frame, SpilledFrame)
+    assert frame.mask("later_int").tolist() == [True, True, False, False]
+    assert frame.values("later_int").tolist()[2:] == [7, 8]
+    assert frame["to_float"].tolist()[:3] == [1.0, 2.0, 2.5]
+    assert np.isnan(frame["to_float"][3])
+    assert frame["to_str"].tolist() == ["1", "2", "a", "b"]
+    # the NULL turns the second chunk into floats, they still fit the integers
+    assert frame.values("whole").dtype == np.int64
+    assert frame.values("whole").tolist()[:3] == [2**60, 1, 4]
+    assert frame.mask("whole").tolist() == [False, False, False, True]
+    frame.close()
@@ -36,3 +36,216 @@ def test_valid_hms_format_call():
 def test_invalid_hms_format_call():
     with pytest.raises(Exception):
         hms_format("text")
+
+
+def test_dataset_summary():
+    import pandas as pd
+    from samesyslib.utils import dataset_summary
+
+    df = pd.DataFrame(
+        {"a": [1.0, None, 3.0, 3.0], "b": ["x", "y", "x", None]},
+        index=pd.Index([10, 11, 12, 13], name="id"),
+    )
+    summary = dataset_summary(df, detail=True, quick=False)
+
+    assert list(summary.index) == ["id", "a", "b"]
+    assert list(summary.columns) == [
+        "type", "first", "last", "min", "max", "mean", "std", "n_uniq", "n_miss", "obs",
+    ]
+    assert summary.loc["a", "n_uniq"] == 2
+    assert summary.loc["b", "n_miss"] == 1
+    assert summary.loc["id", "obs"] == 4
+    assert summary.loc["a", "mean"] == 7 / 3
+    assert pd.isnull(summary.loc["b", "mean"])
+    assert summary.equals(dataset_summary(df, detail=True, quick=False, n_jobs=2))
+
+
+def test_dataset_summary_sample():
+    import numpy as np
+    import pandas as pd
+    from samesyslib.utils import dataset_summary
+
+    df = pd.DataFrame({"key": np.arange(100000), "group": np.arange(100000) % 10})
+    summary = dataset_summary(df, index_summary=False, sample=5000, random_state=0)
+
+    assert summary.loc["key", "obs"] == 100000
+    assert summary.loc["group", "n_uniq"] == 10
+    assert summary.loc["key", "n_uniq"] > 50000
+
+
+def test_remove_special_char_series():
+    import numpy as np
+    import pandas as pd
+    from samesyslib.utils import remove_special_char, remove_special_char_series
+
+    names = pd.Series(["Café  Ølstue!", "Žalias, UAB", np.nan, "Café  Ølstue!"])
+    expected = names.apply(remove_special_char)
+
+    assert expected.tolist() == ["cafe olstue", "zalias uab", "nan", "cafe olstue"]
+    assert remove_special_char_series(names).equals(expected)
+    assert remove_special_char_series(names, replace_ws=True)[1] == "zalias\\s?uab"
+
+
+def test_iter_sql_statements():
+    from samesyslib.utils import iter_sql_statements
+
+    script = (
+        "-- load; shops\n"
+        "SELECT 'a;b', \"c\\\";d\", `e;f` FROM t; # done;\n"
+        "UPDATE t SET x = 'it''s;' WHERE y = 5--3;\n"
+        "DELIMITER $$\n"
+        "CREATE PROCEDURE p()\nBEGIN\n  SELECT 1;\nEND$$\n"
+        "DELIMITER ;\n"
+        "/* nothing; here */\n"
+    )
+    statements = list(iter_sql_statements(script))
+
+    assert statements == [
+        "-- load; shops\nSELECT 'a;b', \"c\\\";d\", `e;f` FROM t",
+        "# done;\nUPDATE t SET x = 'it''s;' WHERE y = 5--3",
+        "CREATE PROCEDURE p()\nBEGIN\n  SELECT 1;\nEND",
+    ]
+
+
+def test_sql_from_file(tmpdir):
+    from samesyslib.utils import sql_from_file
+
+    sql_file = tmpdir.join("query.sql")
+    sql_file.write_text("SELECT ';' AS x;\nSELECT 2\n", encoding="utf-8")
+
+    assert sql_from_file(sql_file.strpath) == ["SELECT ';' AS x", "SELECT 2"]
+
+
+def test_metadata_writer(sqlite_db):
+    import numpy as np
+    from samesyslib.utils import MetadataWriter
+
+    sqlite_db.execute(
+        "CREATE TABLE model_runs (run_id TEXT, model TEXT, epochs INT, "
+        "score REAL, status TEXT DEFAULT 'running')"
+    )
+    sqlite_db.execute("INSERT INTO model_runs (run_id, model) VALUES ('a', 'old')")
+
+    writer = MetadataWriter(
+        sqlite_db, "model_runs", "main", run_id_col="run_id", flush_interval=None
+    )
+    writer.insert({"run_id": "b", "model": "xgboost"})
+    writer.update("b", "epochs", np.int64(10))  # merged into the buffered row
+    writer.update("a", "score", 0.5)
+    writer.update("a", "status", "done")
+    assert sqlite_db.get("SELECT * FROM model_runs").shape[0] == 1
+
+    with pytest.raises(KeyError):
+        writer.update("a", "missing_column", 1)
+
+    writer.close()
+    runs = sqlite_db.get("SELECT * FROM model_runs ORDER BY run_id").set_index("run_id")
+    assert runs.loc["a", "score"] == 0.5
+    assert runs.loc["a", "status"] == "done"
+    assert runs.loc["b", "epochs"] == 10
+    assert runs.loc["b", "status"] == "running"
+
+
+def test_metadata_writer_flushes_on_size(sqlite_db):
+    from samesyslib.utils import MetadataWriter
+
+    sqlite_db.execute("CREATE TABLE runs (run_id TEXT)")
+    writer = MetadataWriter(sqlite_db, "runs", "main", max_pending=3)
+    for run_id in "abcd":
+        writer.insert({"run_id": run_id})
+
+    assert sqlite_db.get("SELECT * FROM runs").shape[0] == 3
+    writer.close()
+    assert sqlite_db.get("SELECT * FROM runs").shape[0] == 4
+
+
+def _batch_frame(batch):
+    import numpy as np
+    import pandas as pd
+
+    return pd.DataFrame(
+        {"shop_id": batch, "sales": np.asarray(batch) * 1.5, "name": "shop"},
+        index=pd.Index(batch, name="shop"),
+    )
+
+
+def test_process_shop_batches():
+    import numpy as np
+    from samesyslib.utils import process_shop_batches
+
+    shops = np.arange(23)
+    result = process_shop_batches(_batch_frame, shops, batch_size=4, max_workers=2)
+
+    assert result["shop_id"].tolist() == shops.tolist()  # batch order
+    assert result["sales"].tolist() == (shops * 1.5).tolist()
+    assert list(result.columns) == ["shop_id", "sales", "name"]
+    assert result.index.name == "shop"
+
+
+def test_group_quantiles():
+    import numpy as np
+    import pandas as pd
+    from samesyslib.utils import group_quantiles, percentile
+
+    rng = np.random.default_rng(0)
+    sales = pd.DataFrame(
+        {
+            "shop_id": rng.integers(0, 20, 2000),
+            "hour": rng.integers(0, 3, 2000),
+            "amount": rng.normal(size=2000),
+            "items": rng.integers(0, 10, 2000),
+        }
+    )
+    sales.loc[::7, "amount"] = np.nan
+    q = [0, 0.1, 0.5, 0.95, 1]
+
+    expected = sales.groupby(["shop_id", "hour"])[["amount", "items"]].agg(
+        [percentile(n) for n in q]
+    )
+    result = group_quantiles(sales, ["shop_id", "hour"], ["amount", "items"], q=q)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    single = group_quantiles(sales, "shop_id", "amount", q=q)
+    assert list(single.columns) == ["q0", "q0.1", "q0.5", "q0.95", "q1"]
+
+
+def test_group_quantiles_missing_and_categorical_keys():
+    import warnings
+
+    import numpy as np
+    import pandas as pd
+    from samesyslib.utils import group_quantiles, percentile
+
+    df = pd.DataFrame({"g": [1, 1, np.nan, 2, 2], "v": [1.0, 2, 3, 4, 5]})
+    expected = df.groupby("g")[["v"]].agg([percentile(0.5)])
+    result = group_quantiles(df, "g", ["v"], q=[0.5])
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    df["g"] = pd.Categorical(["b", "b", None, "c", "c"], categories=["a", "b", "c"])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", FutureWarning)
+        every = group_quantiles(df, "g", "v", q=[0.5])
+        observed = group_quantiles(df, "g", "v", q=[0.5], observed=True)
+    assert every["q0.5"].tolist()[1:] == [1.5, 4.5]
+    assert np.isnan(every["q0.5"]["a"])
+    assert observed["q0.5"].to_dict() == {"b": 1.5, "c": 4.5}
+
+
+def test_quantile_sketch():
+    import numpy as np
+    import pandas as pd
+    from samesyslib.utils import QuantileSketch, group_quantiles
+
+    sales = pd.DataFrame({"shop_id": np.arange(3000) % 3, "amount": np.arange(3000.0)})
+    exact = QuantileSketch("shop_id", "amount", size=1000, random_state=1)
+    small = QuantileSketch("shop_id", "amount", size=100, random_state=1)
+    for start in range(0, 3000, 450):
+        chunk = sales.iloc[start : start + 450]
+        exact.update(chunk)
+        small.update(chunk)
+
+    expected = group_quantiles(sales, "shop_id", "amount", q=[0.5])
+    pd.testing.assert_frame_equal(exact.result(q=[0.5]), expected)
+    error = (small.result(q=[0.5]) - expected).abs().max().max()
+    assert error < 300  # ~10% of the range with 100 of 1000 rows kept per shop
+    assert small.rows == 3000